@@ -11,16 +11,38 @@
 # ------------------------------------------------------------------------------------------
 
 import argparse
+import base64
+import collections
+import concurrent.futures
+import contextlib
 import dataclasses
+import datetime
+import fnmatch
+import hashlib
+import http.server
+import io
+import json
+import multiprocessing
 import os
+import pickle
+import re
+import shutil
+import signal
+import socketserver
 import subprocess
+import sys
+import tarfile
 import tempfile
+import threading
+import time
+import traceback
+import urllib.parse
 import yaml
 
 from dataclasses import dataclass
 
 # Python pre 3.9 doesn't support list[str], but works with List[str].
-from typing import List, Type, Union, Tuple
+from typing import BinaryIO, Callable, ContextManager, Deque, Dict, Iterator, List, Set, TextIO, Type, Union, Tuple
 
 
 APP_NAME = "ak-argocd-renderer"
@@ -30,30 +52,599 @@ APP_NAME = "ak-argocd-renderer"
 # Utils.
 
 
-def exec_capture_output(cmd_args: List[str]) -> str:
-    return subprocess.check_output(cmd_args, text=True)
+# YAML loader class, see select_yaml_backend.
+yaml_loader = yaml.FullLoader
 
 
-def resolve_repo(*, url: str, revision: str, temp_dir: str) -> None:
-    global repo_resolver
+# Select YAML implementation for parsing: 'libyaml', 'python' or 'auto' (libyaml if available).
+# The output is always written by the python dumper, libyaml wraps long non-ASCII scalars differently.
+def select_yaml_backend(backend: str) -> str:
+    global yaml_loader
 
+    libyaml_available = getattr(yaml, "__with_libyaml__", False) and hasattr(
+        yaml, "CFullLoader"
+    )
+
+    if backend == "libyaml" and not libyaml_available:
+        raise ValueError("PyYAML is installed without libyaml support")
+
+    if backend == "python" or not libyaml_available:
+        yaml_loader = yaml.FullLoader
+        return "python"
+
+    yaml_loader = yaml.CFullLoader
+    return "libyaml"
+
+
+def yaml_load(stream: any) -> any:
+    return yaml.load(stream, Loader=yaml_loader)
+
+
+def yaml_load_all(stream: any) -> Iterator[any]:
+    return yaml.load_all(stream, Loader=yaml_loader)
+
+
+def yaml_dump(data: any, stream: any = None, **kwargs) -> Union[str, None]:
+    return yaml.dump(data, stream, Dumper=yaml.Dumper, **kwargs)
+
+
+def yaml_dump_all(documents: List[any], stream: any = None) -> Union[str, None]:
+    return yaml.dump_all(documents, stream, Dumper=yaml.Dumper)
+
+
+# Log goes to stderr when the result is written to stdout.
+log_stream = sys.stdout
+
+# Levels of log messages, from the most verbose; messages below log_level are dropped right away.
+LOG_LEVELS = ("debug", "info", "warning", "error")
+log_level = LOG_LEVELS.index("info")
+
+# Log messages are written as text lines, or as "json": one JSON object per event and line.
+LOG_FORMATS = ("text", "json")
+log_format = "text"
+
+# Records logged by a worker thread are buffered here and written later by the main thread,
+# so that the log of a concurrently rendered source doesn't interleave with other logs.
+log_buffer = threading.local()
+
+# Writes from different threads (serve requests, progress) are whole records, never mixed.
+log_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class LogRecord:
+    time: float
+    level: str
+    msg: str
+    fields: Dict[str, any]
+
+
+# Log a message of the given level, the fields are added to the JSON event.
+def log(msg: str = "", *, level: str = "info", flush: bool = False, **fields: any) -> None:
+    if LOG_LEVELS.index(level) < log_level:
+        return
+
+    record = LogRecord(time=time.time(), level=level, msg=msg, fields=fields)
+
+    records = getattr(log_buffer, "records", None)
+    if records is None:
+        write_log_records([record], flush=flush)
+    else:
+        records.append(record)
+
+
+def write_log_records(records: List[LogRecord], *, flush: bool = False) -> None:
+    if log_format == "json":
+        # Blank lines only separate blocks of the text log.
+        lines = [
+            json.dumps(
+                {
+                    "time": round(record.time, 3),
+                    "level": record.level,
+                    "msg": record.msg.strip(),
+                    **record.fields,
+                },
+                default=str,
+            )
+            for record in records
+            if record.msg or record.fields
+        ]
+    else:
+        lines = [record.msg for record in records]
+
+    if not lines:
+        return
+
+    with log_lock:
+        log_stream.write("\n".join(lines) + "\n")
+        if flush:
+            log_stream.flush()
+
+
+# Open the output file for writing, '-' stands for stdout.
+@contextlib.contextmanager
+def open_output(output_file: str) -> Iterator[TextIO]:
+    if output_file == "-":
+        yield sys.stdout
+        sys.stdout.flush()
+    else:
+        with open(output_file, "w") as file:
+            yield file
+
+
+# Runs external commands (repo resolver, helm, kubectl) and captures their output.
+class CommandExecutor:
+
+    def __init__(
+        self,
+        *,
+        max_processes: Union[int, None] = None,
+        tool_limits: Union[Dict[str, int], None] = None,
+        timeout: Union[float, None] = None,
+    ) -> None:
+        self.__timeout = timeout
+        if max_processes is not None:
+            self.__slots = threading.BoundedSemaphore(max_processes)
+        else:
+            self.__slots = contextlib.nullcontext()
+        self.__tool_slots = {
+            tool: threading.BoundedSemaphore(limit)
+            for tool, limit in (tool_limits or {}).items()
+        }
+
+    # Run the command and return its output, tool defaults to the name of the executable.
+    def run(
+        self,
+        cmd_args: List[str],
+        *,
+        cwd: Union[str, None] = None,
+        env: Union[Dict[str, str], None] = None,
+        input: Union[str, None] = None,
+        tool: Union[str, None] = None,
+    ) -> str:
+        if env is not None:
+            env = dict(os.environ, **env)
+
+        tool_slots = self.__tool_slots.get(tool or os.path.basename(cmd_args[0]))
+
+        # Python 3.7 passes b"" for input=None even in text mode, which fails, so no input means no stdin.
+        if input is None:
+            stdin_args = {"stdin": subprocess.DEVNULL}
+        else:
+            stdin_args = {"input": input}
+
+        with self.__slots, tool_slots or contextlib.nullcontext():
+            try:
+                return subprocess.check_output(
+                    cmd_args,
+                    text=True,
+                    cwd=cwd,
+                    env=env,
+                    timeout=self.__timeout,
+                    **stdin_args,
+                )
+            except subprocess.TimeoutExpired as e:
+                raise ValueError(
+                    f"Command {repr(cmd_args)} didn't finish in {self.__timeout} seconds"
+                ) from e
+
+    def close(self) -> None:
+        pass
+
+
+command_executor = CommandExecutor()
+
+
+def exec_capture_output(
+    cmd_args: List[str],
+    *,
+    cwd: Union[str, None] = None,
+    env: Union[Dict[str, str], None] = None,
+    input: Union[str, None] = None,
+    tool: Union[str, None] = None,
+) -> str:
+    return command_executor.run(cmd_args, cwd=cwd, env=env, input=input, tool=tool)
+
+
+def resolve_repo(
+    *, url: str, revision: str, temp_dir: str, repo_resolver: Union[str, None]
+) -> str:
     if repo_resolver:
-        print("    Checking the repo path...", flush=True)
-        path = exec_capture_output([repo_resolver, url, revision, temp_dir]).strip()
+        log("    Checking the repo path...", flush=True)
+        path = exec_capture_output(
+            [repo_resolver, url, revision, temp_dir], tool="resolver"
+        ).strip()
         path = os.path.abspath(path)
         return path
     else:
         return ""
 
 
-def parse_yaml_file(yaml_file: str) -> List[dict]:
+# Memoized results of the repository resolver.
+class RepoResolutions:
+
+    def __init__(
+        self,
+        repo_resolver: Union[str, None],
+        *,
+        ttl: Union[float, None] = None,
+        max_entries: Union[int, None] = None,
+    ) -> None:
+        self.__repo_resolver = repo_resolver
+        self.__ttl = ttl
+        self.__max_entries = max_entries
+        self.__lock = threading.Lock()
+        # (url, revision) -> (resolution, temp dir, time of resolution), least recently used first.
+        self.__resolutions: "collections.OrderedDict[Tuple[str, str], Tuple[concurrent.futures.Future, str, float]]" = (
+            collections.OrderedDict()
+        )
+        # Each drop starts a new generation; a user may use directories dropped in the generation
+        # it acquired the resolutions in and later ones.
+        self.__generation = 0
+        self.__users: Dict[int, int] = {}
+        self.__dropped_dirs: List[Tuple[int, str]] = []
+        self.__next_dir = 0
+        self.__work_dir: Union[str, None] = None
+
+    # Mark the resolutions as used, return the generation to release them with.
+    def acquire(self) -> int:
+        with self.__lock:
+            generation = self.__generation
+            self.__users[generation] = self.__users.get(generation, 0) + 1
+            return generation
+
+    def release(self, generation: int) -> None:
+        with self.__lock:
+            self.__users[generation] -= 1
+            if not self.__users[generation]:
+                del self.__users[generation]
+            self.__remove_dropped_dirs()
+
+    def resolve(self, *, url: str, revision: str) -> str:
+        key = (url, revision)
+        now = time.monotonic()
+
+        with self.__lock:
+            entry = self.__resolutions.get(key)
+            if (
+                entry is not None
+                and self.__ttl is not None
+                and entry[0].done()
+                and now - entry[2] > self.__ttl
+            ):
+                self.__drop(key)
+                entry = None
+
+            if entry is None:
+                resolution = concurrent.futures.Future()
+                temp_dir = self.__make_temp_dir()
+                self.__resolutions[key] = (resolution, temp_dir, now)
+                self.__evict()
+            else:
+                resolution = entry[0]
+                temp_dir = None
+                self.__resolutions.move_to_end(key)
+
+        if temp_dir is not None:
+            try:
+                resolution.set_result(
+                    resolve_repo(
+                        url=url,
+                        revision=revision,
+                        temp_dir=temp_dir,
+                        repo_resolver=self.__repo_resolver,
+                    )
+                )
+            except Exception as e:
+                resolution.set_exception(e)
+
+                with self.__lock:
+                    entry = self.__resolutions.get(key)
+                    if entry is not None and entry[0] is resolution:
+                        self.__drop(key)
+
+        return resolution.result()
+
+    def __evict(self) -> None:
+        if self.__max_entries is None:
+            return
+
+        for key in list(self.__resolutions):
+            if len(self.__resolutions) <= self.__max_entries:
+                break
+            if self.__resolutions[key][0].done():
+                self.__drop(key)
+
+    def __drop(self, key: Tuple[str, str]) -> None:
+        _, temp_dir, _ = self.__resolutions.pop(key)
+        self.__dropped_dirs.append((self.__generation, temp_dir))
+        self.__generation += 1
+        self.__remove_dropped_dirs()
+
+    def __remove_dropped_dirs(self) -> None:
+        # Users that acquired the resolutions after a directory was dropped never got it.
+        oldest_generation = min(self.__users, default=self.__generation)
+
+        dropped_dirs = []
+        for generation, temp_dir in self.__dropped_dirs:
+            if generation < oldest_generation:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            else:
+                dropped_dirs.append((generation, temp_dir))
+        self.__dropped_dirs = dropped_dirs
+
+    def __make_temp_dir(self) -> str:
+        if self.__work_dir is None:
+            self.__work_dir = tempfile.mkdtemp(prefix=APP_NAME)
+            make_secure(self.__work_dir)
+
+        temp_dir = os.path.join(self.__work_dir, str(self.__next_dir))
+        self.__next_dir += 1
+        os.mkdir(temp_dir)
+        make_secure(temp_dir)
+
+        return temp_dir
+
+    def close(self) -> None:
+        with self.__lock:
+            if self.__work_dir is not None:
+                shutil.rmtree(self.__work_dir, ignore_errors=True)
+                self.__work_dir = None
+
+            self.__resolutions.clear()
+            self.__dropped_dirs.clear()
+
+
+# A YAML document kept as text because it's not an argocd application.
+class RawYamlDocument:
+
+    __slots__ = ("text", "api_version", "kind")
+
+    def __init__(
+        self, text: str, api_version: Union[str, None], kind: Union[str, None]
+    ) -> None:
+        self.text = text
+        self.api_version = api_version
+        self.kind = kind
+
+
+YAML_DOCUMENT_START_RE = re.compile(r"^---[ \t]*(#.*)?$", re.MULTILINE)
+YAML_TOP_LEVEL_LINE_RE = re.compile(r"^[^ \t\r\n#].*$", re.MULTILINE)
+YAML_CONTENT_LINE_RE = re.compile(r"^[ \t]*[^ \t\r\n#]", re.MULTILINE)
+YAML_SIMPLE_KEY_RE = re.compile(r"^([A-Za-z_][A-Za-z0-9_.-]*)[ \t]*:(?:[ \t]+(.*?))?[ \t]*$")
+YAML_SIMPLE_VALUE_RE = re.compile(
+    r"^(?:([A-Za-z0-9_./-]+)|'([A-Za-z0-9_./ -]*)'|\"([A-Za-z0-9_./ -]*)\")[ \t]*(?:#.*)?$"
+)
+
+
+# Split a YAML stream into the texts of its documents, the same way the parser would.
+def split_yaml_documents(text: str) -> Union[List[str], None]:
+    if re.search(r"^(%|\.\.\.)", text, re.MULTILINE) or re.search(
+        r"^---[ \t]+[^ \t#\r\n]", text, re.MULTILINE
+    ):
+        return None
+
+    chunks = YAML_DOCUMENT_START_RE.split(text)
+    # Split puts the captured comment of each separator between the chunks.
+    docs = chunks[0::2]
+
+    # Text before the first separator is a document only if it has some content.
+    if not YAML_CONTENT_LINE_RE.search(docs[0]):
+        docs = docs[1:]
+
+    return docs
+
+
+# Find top-level apiVersion and kind of the document without parsing it.
+def scan_yaml_document_header(doc: str) -> Union[Tuple[Union[str, None], Union[str, None]], None]:
+    header = {}
+
+    for match in YAML_TOP_LEVEL_LINE_RE.finditer(doc):
+        key_match = YAML_SIMPLE_KEY_RE.match(match.group(0))
+        if key_match is None:
+            return None
+
+        key, value = key_match.group(1), key_match.group(2) or ""
+        if value[:1] in ("{", "["):
+            # Flow collections may continue on the next top-level lines.
+            return None
+
+        if key in ("apiVersion", "kind"):
+            value_match = YAML_SIMPLE_VALUE_RE.match(value)
+            if key in header or value_match is None:
+                return None
+            header[key] = [v for v in value_match.groups() if v is not None][0]
+
+    if not YAML_TOP_LEVEL_LINE_RE.search(doc):
+        return None
+
+    return header.get("apiVersion"), header.get("kind")
+
+
+# Parse all documents of a YAML stream.
+def parse_yaml_text(
+    text: str, *, origin: str, raw_passthrough: bool = False
+) -> List[any]:
+    try:
+        docs = split_yaml_documents(text) if raw_passthrough else None
+        if docs is None:
+            return list(yaml_load_all(text))
+
+        result = []
+        for doc in docs:
+            if not YAML_CONTENT_LINE_RE.search(doc):
+                result.append(None)
+                continue
+
+            header = scan_yaml_document_header(doc)
+            if header is None or header == ("argoproj.io/v1alpha1", "Application"):
+                result.append(yaml_load(doc))
+            else:
+                result.append(RawYamlDocument(doc.strip("\r\n") + "\n", *header))
+
+        return result
+    except Exception as e:
+        raise ValueError(f"Failed to parse yaml from {repr(origin)}") from e
+
+
+def parse_yaml_file(yaml_file: str, *, raw_passthrough: bool = False) -> List[any]:
     try:
         with open(yaml_file, "r") as file:
-            return list(yaml.full_load_all(file))
+            text = file.read()
+    except Exception as e:
+        raise ValueError(f"Failed to parse yaml file {repr(yaml_file)}") from e
+
+    if raw_passthrough:
+        return parse_yaml_text(text, origin=yaml_file, raw_passthrough=True)
+
+    try:
+        return list(yaml_load_all(text))
     except Exception as e:
         raise ValueError(f"Failed to parse yaml file {repr(yaml_file)}") from e
 
 
+# Parsed YAML files by their identity (path, inode, modification time and size).
+class ParseCache:
+
+    def __init__(self, max_size: int) -> None:
+        self.__max_size = max_size
+        self.__lock = threading.Lock()
+        self.__entries: "collections.OrderedDict[tuple, bytes]" = collections.OrderedDict()
+
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def parse_file(self, yaml_file: str, *, raw_passthrough: bool = False) -> List[any]:
+        key, docs = self.lookup(yaml_file, raw_passthrough=raw_passthrough)
+        if docs is None:
+            docs = parse_yaml_file(yaml_file, raw_passthrough=raw_passthrough)
+            self.store(key, docs)
+        return docs
+
+    # Return the key to store the parsed file with and the cached documents, if any.
+    def lookup(
+        self, yaml_file: str, *, raw_passthrough: bool = False
+    ) -> Tuple[Union[tuple, None], Union[List[any], None]]:
+        try:
+            stat = os.stat(yaml_file)
+        except OSError:
+            return None, None
+
+        key = (
+            yaml_file,
+            stat.st_dev,
+            stat.st_ino,
+            stat.st_mtime_ns,
+            stat.st_size,
+            raw_passthrough,
+        )
+
+        with self.__lock:
+            data = self.__entries.get(key)
+            if data is None:
+                self.misses += 1
+                return key, None
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+
+        return key, pickle.loads(data)
+
+    def store(self, key: Union[tuple, None], docs: List[any]) -> None:
+        if key is None:
+            return
+
+        data = pickle.dumps(docs, protocol=pickle.HIGHEST_PROTOCOL)
+
+        with self.__lock:
+            if len(data) <= self.__max_size and key not in self.__entries:
+                self.__entries[key] = data
+                self.size += len(data)
+
+                while self.size > self.__max_size:
+                    _, evicted = self.__entries.popitem(last=False)
+                    self.size -= len(evicted)
+                    self.evictions += 1
+
+
+# Parse the files in a worker process, None stands for a file that failed to parse.
+def parse_yaml_files_in_worker(
+    yaml_files: List[str], yaml_backend: str, raw_passthrough: bool
+) -> List[Union[List[any], None]]:
+    select_yaml_backend(yaml_backend)
+
+    result = []
+    for yaml_file in yaml_files:
+        try:
+            result.append(parse_yaml_file(yaml_file, raw_passthrough=raw_passthrough))
+        except ValueError:
+            result.append(None)
+
+    return result
+
+
+# Files directory sources are made of, other files are skipped with skip_non_yaml (as Argo CD does).
+YAML_FILE_EXTENSIONS = (".yaml", ".yml", ".json")
+
+
+# Return paths of all files under base_dir, ordered as the sorted os.walk was.
+def list_files_in_dir_rec(
+    base_dir: str, *, extensions: Union[Tuple[str, ...], None] = None
+) -> List[str]:
+    files_by_dir: Dict[str, List[str]] = {}
+    pending = [base_dir]
+
+    while pending:
+        dir_path = pending.pop()
+        files = []
+
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+
+                    if is_dir:
+                        if not entry.is_symlink():
+                            pending.append(entry.path)
+                    elif extensions is None or os.path.splitext(entry.name)[1] in extensions:
+                        files.append(entry.name)
+        except OSError:
+            continue
+
+        files_by_dir[dir_path] = files
+
+    result = []
+    for dir_path in sorted(files_by_dir):
+        result += [os.path.join(dir_path, file) for file in sorted(files_by_dir[dir_path])]
+
+    return result
+
+
+HELM_SOURCE_RE = re.compile(r"^---[ \t]*\n# Source: (.+?)[ \t]*$", re.MULTILINE)
+
+
+# Split stdout of 'helm template' into the files 'helm template --output-dir' would write.
+def split_helm_template_output(text: str) -> Union[List[Tuple[str, str]], None]:
+    matches = list(HELM_SOURCE_RE.finditer(text))
+    if not matches or text[: matches[0].start()].strip():
+        return [] if not text.strip() else None
+
+    chunks_by_path: Dict[str, List[str]] = {}
+    ends = [match.start() for match in matches[1:]] + [len(text)]
+    for match, end in zip(matches, ends):
+        chunks_by_path.setdefault(match.group(1), []).append(text[match.start() : end])
+
+    return sorted(
+        ((path, "".join(chunks)) for path, chunks in chunks_by_path.items()),
+        key=lambda file: (os.path.dirname(file[0]), os.path.basename(file[0])),
+    )
+
+
 def get_x(
     d: dict, name: str, err_path: str, req: bool, cls: Type, cls_name: str
 ) -> str:
@@ -91,22 +682,820 @@ def make_secure(dir: str) -> None:
     os.chown(dir, os.getuid(), os.getgid())
 
 
+# Temporary directory that is created when its path is used first, and removed on exit if it was.
+class LazyTempDir:
+
+    def __init__(self, *, prefix: str) -> None:
+        self.__prefix = prefix
+        self.__path: Union[str, None] = None
+
+    @property
+    def path(self) -> str:
+        if self.__path is None:
+            self.__path = tempfile.mkdtemp(prefix=self.__prefix)
+            make_secure(self.__path)
+        return self.__path
+
+    def __enter__(self) -> "LazyTempDir":
+        return self
+
+    def __exit__(self, *_exc_info) -> None:
+        if self.__path is not None:
+            shutil.rmtree(self.__path, ignore_errors=True)
+
+
 def dump_as_yaml_for_debug(d: dict, *, indent: str) -> None:
-    return "\n".join([f"{indent}{l}" for l in yaml.dump(d).split("\n")])
+    text = d.text if isinstance(d, RawYamlDocument) else yaml_dump(d)
+    return "\n".join([f"{indent}{l}" for l in text.split("\n")])
+
+
+# ################################################################################################
+# Render cache.
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Return existing local paths referenced by relative strings in a kustomization or chart file.
+def find_referenced_paths(yaml_file: str) -> List[str]:
+    try:
+        docs = parse_yaml_file(yaml_file)
+    except ValueError:
+        return []
+
+    base_dir = os.path.dirname(yaml_file)
+    result = []
+
+    def visit(v: any) -> None:
+        if type(v) is dict:
+            for item in v.values():
+                visit(item)
+        elif type(v) is list:
+            for item in v:
+                visit(item)
+        elif type(v) is str and "\n" not in v:
+            path = v[len("file://") :] if v.startswith("file://") else v
+            if path and not os.path.isabs(path) and "://" not in path:
+                path = os.path.normpath(os.path.join(base_dir, path))
+                if os.path.exists(path):
+                    result.append(path)
+
+    for doc in docs:
+        visit(doc)
+
+    return result
+
+
+# Digest of all files a helm chart or kustomization in the given directory may depend on.
+def source_tree_digest(source_dir: str) -> str:
+    h = hashlib.sha256()
+
+    source_dir = os.path.normpath(source_dir)
+    pending = [source_dir]
+    seen = set()
+
+    while pending:
+        root = pending.pop(0)
+        if any(root == s or root.startswith(s + os.sep) for s in seen):
+            continue
+        seen.add(root)
+
+        if os.path.isfile(root):
+            files = [root]
+        else:
+            files = []
+            walk = list(os.walk(root))
+            walk.sort(key=lambda x: x[0])
+            for file_dir, _, dir_files in walk:
+                files += [os.path.join(file_dir, f) for f in sorted(dir_files)]
+
+        for file in files:
+            h.update(os.path.relpath(file, source_dir).encode() + b"\0")
+            h.update(file_digest(file).encode() + b"\0")
+
+            if os.path.basename(file) in (
+                "kustomization.yaml",
+                "kustomization.yml",
+                "Kustomization",
+                "Chart.yaml",
+                "requirements.yaml",
+            ):
+                pending += find_referenced_paths(file)
+
+    return h.hexdigest()
+
+
+def make_digest_key(components: dict) -> str:
+    return hashlib.sha256(yaml_dump(components).encode()).hexdigest()
+
+
+# Tool versions and source tree digests, computed once per run.
+class SourceDigests:
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__tool_versions: Dict[str, str] = {}
+        self.__tree_digests: Dict[str, str] = {}
+
+    def tool_version(self, tool: str, version_args: List[str]) -> str:
+        with self.__lock:
+            version = self.__tool_versions.get(tool)
+            if version is None:
+                version = exec_capture_output([tool] + version_args).strip()
+                self.__tool_versions[tool] = version
+            return version
+
+    def tree_digest(self, source_dir: str) -> str:
+        with self.__lock:
+            digest = self.__tree_digests.get(source_dir)
+        if digest is None:
+            digest = source_tree_digest(source_dir)
+            with self.__lock:
+                self.__tree_digests[source_dir] = digest
+        return digest
+
+
+# Persistent on-disk cache of helm/kustomize outputs with size-bounded LRU eviction.
+class RenderCache:
+
+    RENDERS_DIR = "renders"
+    CHART_DEPS_DIR = "chart-deps"
+
+    def __init__(self, *, cache_dir: str, max_size: int) -> None:
+        self.__dir = cache_dir
+        self.__max_size = max_size
+        self.__lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Entry path relative to the cache dir -> (size, last use).
+        self.__entries: Dict[str, Tuple[int, int]] = {}
+        for sub_dir in (self.RENDERS_DIR, self.CHART_DEPS_DIR):
+            os.makedirs(os.path.join(self.__dir, sub_dir), exist_ok=True)
+            for entry in os.scandir(os.path.join(self.__dir, sub_dir)):
+                if not entry.name.startswith(".tmp-") and entry.is_file():
+                    stat = entry.stat()
+                    self.__entries[os.path.join(sub_dir, entry.name)] = (
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                    )
+
+    def get(self, key: str) -> Union[List[Tuple[Union[str, None], str]], None]:
+        try:
+            with open(self.__use(os.path.join(self.RENDERS_DIR, key + ".json"))) as f:
+                files = [tuple(file) for file in json.load(f)["files"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            with self.__lock:
+                self.misses += 1
+            return None
+
+        with self.__lock:
+            self.hits += 1
+
+        return files
+
+    # Whether the output is cached, without using the entry.
+    def contains(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.__dir, self.RENDERS_DIR, key + ".json"))
+
+    def put(self, key: str, files: List[Tuple[Union[str, None], str]]) -> None:
+        def write(f: BinaryIO) -> None:
+            f.write(json.dumps({"files": files}).encode())
+
+        self.__put(os.path.join(self.RENDERS_DIR, key + ".json"), write)
+
+    # Extract cached dependencies of a chart into charts_dir, returns False if they are not cached.
+    def get_chart_dependencies(self, digest: str, charts_dir: str) -> bool:
+        try:
+            with tarfile.open(
+                self.__use(os.path.join(self.CHART_DEPS_DIR, digest + ".tar"))
+            ) as tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(charts_dir, filter="data")
+                else:
+                    tar.extractall(charts_dir)
+        except (OSError, tarfile.TarError):
+            return False
+
+        return True
+
+    def put_chart_dependencies(self, digest: str, charts_dir: str) -> None:
+        def write(f: BinaryIO) -> None:
+            with tarfile.open(fileobj=f, mode="w") as tar:
+                tar.add(charts_dir, arcname=".")
+
+        self.__put(os.path.join(self.CHART_DEPS_DIR, digest + ".tar"), write)
+
+    # Mark the entry as recently used and return its path.
+    def __use(self, name: str) -> str:
+        path = os.path.join(self.__dir, name)
+        os.utime(path)
+
+        with self.__lock:
+            self.__entries[name] = (os.path.getsize(path), os.stat(path).st_mtime_ns)
+
+        return path
+
+    def __put(self, name: str, write: Callable[[BinaryIO], None]) -> None:
+        path = os.path.join(self.__dir, name)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        stat = os.stat(path)
+        with self.__lock:
+            self.__entries[name] = (stat.st_size, stat.st_mtime_ns)
+            self.__evict()
+
+    def __evict(self) -> None:
+        total_size = sum(size for size, _ in self.__entries.values())
+        if total_size <= self.__max_size:
+            return
+
+        for name, (size, _) in sorted(self.__entries.items(), key=lambda x: x[1][1]):
+            if total_size <= self.__max_size:
+                break
+
+            try:
+                os.unlink(os.path.join(self.__dir, name))
+            except FileNotFoundError:
+                pass
+
+            del self.__entries[name]
+            total_size -= size
+            self.evictions += 1
+
+
+# Resolved dependencies of local helm charts.
+class ChartDependencies:
+
+    DEPENDENCY_FILES = ("Chart.yaml", "Chart.lock", "requirements.yaml", "requirements.lock")
+
+    def __init__(
+        self,
+        render_cache: Union[RenderCache, None],
+        *,
+        ttl: Union[float, None] = None,
+        max_entries: Union[int, None] = None,
+    ) -> None:
+        self.__render_cache = render_cache
+        self.__ttl = ttl
+        self.__max_entries = max_entries
+        self.__lock = threading.Lock()
+        # digest -> (resolution, build dir, time of resolution), least recently used first.
+        self.__resolutions: "collections.OrderedDict[str, Tuple[concurrent.futures.Future, str, float]]" = (
+            collections.OrderedDict()
+        )
+        # Number of renders copying each build dir, dropped build dirs are removed when it's 0.
+        self.__dir_users: Dict[str, int] = {}
+        self.__dropped_dirs: Set[str] = set()
+        self.__next_dir = 0
+        self.__in_place_locks: Dict[str, threading.Lock] = {}
+        self.__work_dir: Union[str, None] = None
+
+        self.built = 0
+        self.reused = 0
+
+    @staticmethod
+    def get_dependencies(chart_path: str) -> List[dict]:
+        dependencies = []
+
+        for file in ("Chart.yaml", "requirements.yaml"):
+            path = os.path.join(chart_path, file)
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    dependencies += (yaml_load(f) or {}).get("dependencies") or []
+
+        return dependencies
+
+    # Lock for charts that must have their dependencies updated in place.
+    def in_place_lock(self, chart_path: str) -> threading.Lock:
+        with self.__lock:
+            return self.__in_place_locks.setdefault(chart_path, threading.Lock())
+
+    # Directory with resolved content of 'charts' directory for the chart, kept until exit.
+    @contextlib.contextmanager
+    def resolved(self, chart_path: str) -> Iterator[str]:
+        h = hashlib.sha256()
+        for file in self.DEPENDENCY_FILES:
+            path = os.path.join(chart_path, file)
+            h.update(file.encode() + b"\0")
+            h.update((file_digest(path) if os.path.exists(path) else "-").encode() + b"\0")
+        digest = h.hexdigest()
+        now = time.monotonic()
+
+        with self.__lock:
+            entry = self.__resolutions.get(digest)
+            if (
+                entry is not None
+                and self.__ttl is not None
+                and entry[0].done()
+                and now - entry[2] > self.__ttl
+            ):
+                # Dependencies without a lock file may have newer versions by now.
+                self.__drop(digest)
+                entry = None
+
+            if entry is None:
+                resolution = concurrent.futures.Future()
+                build_dir = self.__make_build_dir()
+                self.__resolutions[digest] = (resolution, build_dir, now)
+                self.__evict()
+                building = True
+            else:
+                resolution, build_dir, _ = entry
+                self.__resolutions.move_to_end(digest)
+                building = False
+                self.reused += 1
+
+            self.__dir_users[build_dir] = self.__dir_users.get(build_dir, 0) + 1
+
+        try:
+            if building:
+                try:
+                    resolution.set_result(self.__build(chart_path, digest, build_dir))
+                except Exception as e:
+                    resolution.set_exception(e)
+
+                    # Failed builds are not kept, the next render of the chart builds it again.
+                    with self.__lock:
+                        entry = self.__resolutions.get(digest)
+                        if entry is not None and entry[0] is resolution:
+                            self.__drop(digest)
+
+            yield resolution.result()
+        finally:
+            with self.__lock:
+                self.__dir_users[build_dir] -= 1
+                if not self.__dir_users[build_dir]:
+                    del self.__dir_users[build_dir]
+                    if build_dir in self.__dropped_dirs:
+                        self.__dropped_dirs.discard(build_dir)
+                        shutil.rmtree(build_dir, ignore_errors=True)
+
+    def __evict(self) -> None:
+        if self.__max_entries is None:
+            return
+
+        for digest in list(self.__resolutions):
+            if len(self.__resolutions) <= self.__max_entries:
+                break
+            if self.__resolutions[digest][0].done():
+                self.__drop(digest)
+
+    def __drop(self, digest: str) -> None:
+        _, build_dir, _ = self.__resolutions.pop(digest)
+        if build_dir in self.__dir_users:
+            self.__dropped_dirs.add(build_dir)
+        else:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+    def __make_build_dir(self) -> str:
+        if self.__work_dir is None:
+            self.__work_dir = tempfile.mkdtemp(prefix=APP_NAME)
+            make_secure(self.__work_dir)
+
+        # Not created, the chart is copied there.
+        build_dir = os.path.join(self.__work_dir, str(self.__next_dir))
+        self.__next_dir += 1
+
+        return build_dir
+
+    def __build(self, chart_path: str, digest: str, build_dir: str) -> str:
+        charts_dir = os.path.join(build_dir, "charts")
+
+        if self.__render_cache is not None and self.__render_cache.get_chart_dependencies(
+            digest, charts_dir
+        ):
+            log("    Using cached chart dependencies...", flush=True)
+            with self.__lock:
+                self.reused += 1
+            return charts_dir
+
+        log("    Building chart dependencies...", flush=True)
+
+        shutil.copytree(chart_path, build_dir, symlinks=True)
+
+        has_lock = os.path.exists(os.path.join(build_dir, "Chart.lock")) or os.path.exists(
+            os.path.join(build_dir, "requirements.lock")
+        )
+        exec_capture_output(
+            ["helm", "dependency", "build" if has_lock else "update", build_dir]
+        )
+        os.makedirs(charts_dir, exist_ok=True)
+
+        with self.__lock:
+            self.built += 1
+
+        if self.__render_cache is not None:
+            self.__render_cache.put_chart_dependencies(digest, charts_dir)
+
+        return charts_dir
+
+    def close(self) -> None:
+        with self.__lock:
+            if self.__work_dir is not None:
+                shutil.rmtree(self.__work_dir, ignore_errors=True)
+                self.__work_dir = None
+
+            self.__resolutions.clear()
+            self.__dropped_dirs.clear()
+
+
+# Rendered resources of application sources from the previous run, with their fingerprints.
+class IncrementalState:
+
+    VERSION = 1
+
+    def __init__(self, state_file: str) -> None:
+        self.__state_file = state_file
+        self.__lock = threading.Lock()
+        self.__previous: Dict[str, dict] = {}
+        self.__current: Dict[str, dict] = {}
+
+        self.reused = 0
+        self.rendered = 0
+
+        if os.path.exists(state_file):
+            try:
+                with open(state_file, "r") as f:
+                    state = yaml_load(f)
+                if type(state) is dict and state.get("version") == self.VERSION:
+                    self.__previous = get_dict(state, "apps", err_path="", req=True)
+            except (OSError, ValueError, yaml.YAMLError) as e:
+                log(f"Ignoring the incremental state file {repr(state_file)}: {e}", level="warning")
+
+    @staticmethod
+    def __source_key(app_id: str, source_index: int) -> str:
+        return f"{app_id}#{source_index}"
+
+    def lookup(
+        self, app_id: str, source_index: int, fingerprint: str
+    ) -> Union[List["ResourceCtx"], None]:
+        entry = self.__previous.get(self.__source_key(app_id, source_index))
+        if type(entry) is not dict or entry.get("fingerprint") != fingerprint:
+            resource_ctxs = None
+        else:
+            try:
+                resource_ctxs = self.__load_resource_ctxs(app_id, entry)
+            except (KeyError, TypeError, ValueError) as e:
+                log(
+                    f"Ignoring the incremental state of {repr(app_id)} source {source_index}: {repr(e)}",
+                    level="warning",
+                )
+                resource_ctxs = None
+
+        with self.__lock:
+            if resource_ctxs is None:
+                self.rendered += 1
+            else:
+                self.reused += 1
+
+        return resource_ctxs
+
+    @staticmethod
+    def __load_resource_ctxs(app_id: str, entry: dict) -> List["ResourceCtx"]:
+        items = entry.get("resources") or []
+        if type(items) is not list:
+            raise TypeError(f"resources must be a list, got {type(items).__name__}")
+
+        resource_ctxs = []
+        # Resources of a file have the same origin, share it.
+        origins: Dict[str, "Origin"] = {}
+        for item in items:
+            if type(item) is not dict or type(item["origin"]) is not str:
+                raise TypeError(f"Malformed resource entry: {repr(item)}")
+
+            if "raw" in item:
+                raw = item["raw"]
+                resource = RawYamlDocument(
+                    str(raw["text"]), str(raw["api_version"]), str(raw["kind"])
+                )
+            else:
+                resource = item["resource"]
+                if type(resource) is not dict:
+                    raise TypeError(f"Malformed resource: {repr(resource)}")
+
+            resource_ctxs.append(
+                ResourceCtx(
+                    origin=origins.setdefault(item["origin"], Origin(item["origin"])),
+                    target_namespace=item["target_namespace"],
+                    resource=resource,
+                    app_id=app_id,
+                )
+            )
+
+        return resource_ctxs
+
+    def record(
+        self,
+        app_id: str,
+        source_index: int,
+        fingerprint: str,
+        resource_ctxs: List["ResourceCtx"],
+    ) -> None:
+        resources = []
+        for resource_ctx in resource_ctxs:
+            item = {
+                "origin": str(resource_ctx.origin),
+                "target_namespace": resource_ctx.target_namespace,
+            }
+            if isinstance(resource_ctx.resource, RawYamlDocument):
+                item["raw"] = {
+                    "text": resource_ctx.resource.text,
+                    "api_version": resource_ctx.resource.api_version,
+                    "kind": resource_ctx.resource.kind,
+                }
+            else:
+                item["resource"] = resource_ctx.resource
+            resources.append(item)
+
+        with self.__lock:
+            self.__current[self.__source_key(app_id, source_index)] = {
+                "fingerprint": fingerprint,
+                "resources": resources,
+            }
+
+    def save(self) -> None:
+        state_dir = os.path.dirname(os.path.abspath(self.__state_file))
+        fd, tmp_path = tempfile.mkstemp(dir=state_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                yaml_dump({"version": self.VERSION, "apps": self.__current}, f)
+            os.replace(tmp_path, self.__state_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+# ################################################################################################
+# Profiling.
+
+
+# Records wall and CPU time of the rendering stages for each application and source.
+class Profiler:
+
+    def __init__(self, *, timeline: bool = False) -> None:
+        self.__lock = threading.Lock()
+        self.__scope = threading.local()
+        self.__start = time.perf_counter()
+        # Totals by (stage, app, source), stages recorded per resource must not take memory per resource.
+        self.__totals: Dict[Tuple[str, Union[str, None], Union[str, None]], dict] = {}
+        # With timeline, spans for the chrome trace. A stage recorded again on the same thread for the
+        # same application and source extends the last span of the stage on the thread.
+        self.__spans: Union[List[dict], None] = [] if timeline else None
+        self.__last_spans: Dict[Tuple[str, str], dict] = {}
+
+    # Attribute stages recorded by the current thread to the given application and source.
+    @contextlib.contextmanager
+    def scope(self, *, app: str, source: str) -> Iterator[None]:
+        prev = getattr(self.__scope, "labels", (None, None))
+        self.__scope.labels = (app, source)
+        try:
+            yield
+        finally:
+            self.__scope.labels = prev
+
+    @contextlib.contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            end_wall = time.perf_counter()
+            wall = end_wall - start_wall
+            cpu = time.thread_time() - start_cpu
+            app, source = getattr(self.__scope, "labels", (None, None))
+
+            with self.__lock:
+                total = self.__totals.get((stage, app, source))
+                if total is None:
+                    total = {
+                        "stage": stage,
+                        "app": app,
+                        "source": source,
+                        "start": start_wall - self.__start,
+                        "count": 0,
+                        "wall": 0.0,
+                        "cpu": 0.0,
+                    }
+                    self.__totals[(stage, app, source)] = total
+                total["count"] += 1
+                total["wall"] += wall
+                total["cpu"] += cpu
+
+                if self.__spans is not None:
+                    thread = threading.current_thread().name
+                    span = self.__last_spans.get((thread, stage))
+                    if span is None or span["app"] != app or span["source"] != source:
+                        span = {
+                            "stage": stage,
+                            "app": app,
+                            "source": source,
+                            "thread": thread,
+                            "start": start_wall - self.__start,
+                            "count": 0,
+                            "cpu": 0.0,
+                        }
+                        self.__spans.append(span)
+                        self.__last_spans[(thread, stage)] = span
+                    span["end"] = end_wall - self.__start
+                    span["count"] += 1
+                    span["cpu"] += cpu
+
+    def print_report(self, *, top: int) -> None:
+        with self.__lock:
+            records = [dict(total) for total in self.__totals.values()]
+
+        def print_table(title: str, key_names: List[str]) -> None:
+            totals: Dict[tuple, List[float]] = {}
+            for record in records:
+                total = totals.setdefault(tuple(record[k] for k in key_names), [0, 0.0, 0.0])
+                total[0] += record["count"]
+                total[1] += record["wall"]
+                total[2] += record["cpu"]
+
+            log(title)
+            log(f"  {'wall, s':>10} {'cpu, s':>10} {'count':>7}  {' / '.join(key_names)}")
+            for key, (count, wall, cpu) in sorted(
+                totals.items(), key=lambda x: -x[1][1]
+            )[:top]:
+                labels = " / ".join("-" if k is None else k for k in key)
+                log(f"  {wall:10.3f} {cpu:10.3f} {count:7}  {labels}")
+            log("")
+
+        print_table("Time by stage:", ["stage"])
+        print_table(f"Top {top} by wall time:", ["stage", "app", "source"])
+
+        times = os.times()
+        log(
+            f"Total wall time: {time.perf_counter() - self.__start:.3f} s, "
+            + f"renderer CPU time: {time.process_time():.3f} s, "
+            + f"child processes CPU time: {times.children_user + times.children_system:.3f} s."
+        )
+        log("")
+
+    def write(self, output_file: str, *, format: str) -> None:
+        with self.__lock:
+            records = [dict(total) for total in self.__totals.values()]
+            spans = None if self.__spans is None else [dict(span) for span in self.__spans]
+
+        if format == "chrome":
+            if spans is None:
+                raise ValueError("The chrome format needs a profiler with timeline")
+
+            # A track per thread and stage, merged spans of a stage don't overlap on its track.
+            pid = os.getpid()
+            tracks: Dict[Tuple[str, str], int] = {}
+            events = []
+            for span in spans:
+                track = (span["thread"], span["stage"])
+                tid = tracks.get(track)
+                if tid is None:
+                    tid = tracks[track] = len(tracks) + 1
+                    events.append(
+                        {
+                            "name": "thread_name",
+                            "ph": "M",
+                            "pid": pid,
+                            "tid": tid,
+                            "args": {"name": f"{span['thread']} {span['stage']}"},
+                        }
+                    )
+                events.append(
+                    {
+                        "name": span["stage"],
+                        "cat": span["stage"],
+                        "ph": "X",
+                        "ts": int(span["start"] * 1e6),
+                        "dur": int((span["end"] - span["start"]) * 1e6),
+                        "pid": pid,
+                        "tid": tid,
+                        "args": {
+                            "app": span["app"],
+                            "source": span["source"],
+                            "count": span["count"],
+                            "cpu": span["cpu"],
+                        },
+                    }
+                )
+            data = {"traceEvents": events}
+        elif format == "json":
+            data = {"records": records}
+        else:
+            raise ValueError(f"Unknown profile format: {repr(format)}")
+
+        try:
+            with open_output(output_file) as file:
+                json.dump(data, file, indent=1)
+        except Exception as e:
+            raise ValueError(f"Failed to write profile to {repr(output_file)}") from e
 
 
 # ################################################################################################
 # Models.
 
 
+# Recreate the dataclass with __slots__, like dataclass(slots=True) of python 3.10+ does.
+def slotted_dataclass(cls: Type) -> Type:
+    field_names = tuple(field.name for field in dataclasses.fields(cls))
+
+    cls_dict = dict(cls.__dict__)
+    for name in field_names + ("__dict__", "__weakref__"):
+        # Class attributes of defaults would conflict with the slots, __init__ has them anyway.
+        cls_dict.pop(name, None)
+    cls_dict["__slots__"] = field_names
+
+    if cls.__dataclass_params__.frozen:
+        # Pickle restores slots with setattr, which frozen dataclasses don't allow.
+        def __getstate__(self) -> list:
+            return [getattr(self, name) for name in field_names]
+
+        def __setstate__(self, state: list) -> None:
+            for name, value in zip(field_names, state):
+                object.__setattr__(self, name, value)
+
+        cls_dict["__getstate__"] = __getstate__
+        cls_dict["__setstate__"] = __setstate__
+
+    slotted_cls = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    slotted_cls.__qualname__ = cls.__qualname__
+    return slotted_cls
+
+
+# Where a resource comes from: the input file, the applications and the files it was rendered from.
+class Origin:
+
+    __slots__ = ("parent", "segment")
+
+    def __init__(self, segment: str, parent: Union["Origin", None] = None) -> None:
+        self.parent = parent
+        self.segment = sys.intern(segment)
+
+    def child(self, segment: str) -> "Origin":
+        return Origin(segment, self)
+
+    # The same origin under new_base instead of base, which must be this origin or one of its parents.
+    def rebase(self, base: "Origin", new_base: "Origin") -> "Origin":
+        if self is base or self == base:
+            return new_base
+        return Origin(self.segment, self.parent.rebase(base, new_base))
+
+    def __str__(self) -> str:
+        segments = []
+        origin = self
+        while origin is not None:
+            segments.append(origin.segment)
+            origin = origin.parent
+        return " / ".join(reversed(segments))
+
+    def __repr__(self) -> str:
+        return repr(str(self))
+
+    def __eq__(self, other: any) -> bool:
+        if not isinstance(other, Origin):
+            return False
+
+        # Origins of the same tree share their parents, so this usually stops after a segment or two.
+        origin = self
+        while origin is not other:
+            if origin is None or other is None or origin.segment != other.segment:
+                return False
+            origin = origin.parent
+            other = other.parent
+        return True
+
+    def __hash__(self) -> int:
+        # Equal origins end with the same segment, hashing the whole chain would cost as much as str().
+        return hash(self.segment)
+
+
 # NOTE: No kw_args in dataclasses because older python versions don't support it.
+@slotted_dataclass
 @dataclass(frozen=True)
 class ResourceCtx:
-    origin: str
+    origin: Origin
     target_namespace: Union[str, None]
     resource: dict
+    # Id of the argocd application that rendered the resource, None for resources of the input.
+    app_id: Union[str, None] = None
 
 
+@slotted_dataclass
 @dataclass(frozen=True)
 class ArgocdAppSourceHelm:
     values: dict
@@ -127,7 +1516,7 @@ class ArgocdAppSourceHelm:
 
         values_str = get_str(resource, "values", err_path=err_path, req=False)
         if values_str is not None:
-            values.update(yaml.full_load(values_str))
+            values.update(yaml_load(values_str))
 
         parameters = get_list(resource, "parameters", err_path=err_path, req=False)
         if parameters is not None:
@@ -173,6 +1562,7 @@ class ArgocdAppSourceHelm:
         )
 
 
+@slotted_dataclass
 @dataclass(frozen=True)
 class ArgocdAppSource:
     repo_url: str
@@ -182,123 +1572,756 @@ class ArgocdAppSource:
     chart: Union[str, None]
     orig_resource: dict
 
-    @staticmethod
-    def from_resource(resource: dict) -> "ArgocdAppSource":
-        err_path = ".spec.source(s)"
-        repo_url = get_str(resource, "repoURL", err_path=err_path, req=True)
-        path = get_str(resource, "path", err_path=err_path, req=False)
-        target_revision = get_str(
-            resource, "targetRevision", err_path=err_path, req=True
-        )
+    @staticmethod
+    def from_resource(resource: dict) -> "ArgocdAppSource":
+        err_path = ".spec.source(s)"
+        repo_url = get_str(resource, "repoURL", err_path=err_path, req=True)
+        path = get_str(resource, "path", err_path=err_path, req=False)
+        target_revision = get_str(
+            resource, "targetRevision", err_path=err_path, req=True
+        )
+
+        chart = get_str(resource, "chart", err_path=err_path, req=False)
+        if chart is None and path is None:
+            raise ValueError(f"Either 'chart' or 'path' must be given")
+
+        helm = get_dict(resource, "helm", err_path=err_path, req=False)
+        if helm is not None:
+            helm = ArgocdAppSourceHelm.from_resource(helm)
+
+        if "kustomize" in resource:
+            raise ValueError(
+                f"Passing parameters via 'kustomize' dictionary is not supported"
+            )
+
+        if "directory" in resource:
+            raise ValueError(f"'directory' settings are not supported")
+
+        return ArgocdAppSource(
+            repo_url=repo_url,
+            path=path,
+            target_revision=target_revision,
+            helm=helm,
+            chart=chart,
+            orig_resource=resource,
+        )
+
+
+@slotted_dataclass
+@dataclass(frozen=True)
+class ArgocdApp:
+    src_file: Origin
+    id: str
+    name: str
+    namespace: Union[str, None]
+    destination_namespace: Union[str, None]
+    sources: List[ArgocdAppSource]
+    labels: dict
+
+    @staticmethod
+    def from_resource(resource_ctx: ResourceCtx) -> "ArgocdApp":
+        # Get required metadata or throw exception
+        resource = resource_ctx.resource
+
+        metadata = get_dict(resource, "metadata", err_path="", req=True)
+        name = get_str(metadata, "name", err_path=".metadata", req=True)
+        labels = get_dict(metadata, "labels", err_path=".metadata", req=False) or {}
+
+        namespace = (
+            get_str(metadata, "namespace", err_path=".metadata", req=False)
+            or resource_ctx.target_namespace
+        )
+
+        spec = get_dict(resource, "spec", err_path="", req=True)
+
+        sources = get_list(spec, "sources", err_path=".spec", req=False)
+        source = get_dict(spec, "source", err_path=".spec", req=False)
+
+        if source is not None and sources is not None:
+            raise ValueError("Only one of .spec.source or .spec.sources must be given")
+
+        if source is not None:
+            sources = [source]
+
+        sources = [ArgocdAppSource.from_resource(source) for source in sources]
+
+        destination = get_dict(spec, "destination", err_path=".spec", req=False) or {}
+        destination_namespace = get_str(
+            destination, "namespace", err_path=".spec.destination", req=False
+        )
+
+        return ArgocdApp(
+            id=f"{namespace or ''}/{name}" or name,
+            name=name,
+            namespace=namespace,
+            sources=sources,
+            destination_namespace=destination_namespace,
+            src_file=resource_ctx.origin,
+            labels=labels,
+        )
+
+
+# Filter of argocd applications (see --include and --exclude).
+@dataclass(frozen=True)
+class AppFilter:
+
+    kind: str
+    key: Union[str, None]
+    pattern: Union[str, None]
+
+    @staticmethod
+    def parse(text: str) -> "AppFilter":
+        kind, sep, value = text.partition(":")
+        if not sep or kind not in ("id", "namespace", "label") or not value:
+            raise ValueError(
+                f"Invalid application filter {repr(text)}, expected id:<pattern>, namespace:<pattern>, "
+                + "label:<key>=<pattern> or label:<key>"
+            )
+
+        if kind == "label":
+            key, sep, pattern = value.partition("=")
+            return AppFilter(kind=kind, key=key, pattern=pattern if sep else None)
+
+        return AppFilter(kind=kind, key=None, pattern=value)
+
+    def matches(self, app: ArgocdApp) -> bool:
+        if self.kind == "id":
+            return fnmatch.fnmatchcase(app.id, self.pattern)
+
+        if self.kind == "namespace":
+            return fnmatch.fnmatchcase(app.namespace or "", self.pattern)
+
+        if self.key not in app.labels:
+            return False
+        return self.pattern is None or fnmatch.fnmatchcase(str(app.labels[self.key]), self.pattern)
+
+
+# An input of the batch mode: the resources file, where to write its result and how.
+@dataclass(frozen=True)
+class BatchEntry:
+
+    resources_file: str
+    output_file: str
+    target_namespace: Union[str, None] = None
+    output_format: str = "yaml"
+
+
+# ################################################################################################
+# Renderer.
+
+
+OUTPUT_FORMATS = ("yaml", "jsonl", "split")
+
+# Tools that the plan mode reports for the sources of each kind it would render.
+PLAN_TOOLS = {"helm": "helm", "kustomize": "kubectl"}
+
+
+# Writes resources to a multi-document YAML stream one by one.
+class YamlResultWriter:
+
+    def __init__(self, stream: TextIO) -> None:
+        self.__stream = stream
+        self.__first = True
+
+    def write(
+        self, resource: Union[dict, RawYamlDocument], *, app_id: Union[str, None] = None
+    ) -> None:
+        if isinstance(resource, RawYamlDocument):
+            if not self.__first:
+                self.__stream.write("---\n")
+            self.__stream.write(resource.text)
+        else:
+            yaml_dump(resource, self.__stream, explicit_start=not self.__first)
+        self.__first = False
+
+
+# Convert values YAML has, but JSON hasn't: timestamps as ISO 8601 strings, binary as base64.
+def json_default(value: any) -> any:
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    raise TypeError(f"Can't convert {repr(value)} to JSON")
+
+
+# Writes resources as JSON Lines, one compact JSON object per resource.
+class JsonLinesResultWriter:
+
+    def __init__(self, stream: TextIO) -> None:
+        self.__stream = stream
+
+    def write(
+        self, resource: Union[dict, RawYamlDocument], *, app_id: Union[str, None] = None
+    ) -> None:
+        if isinstance(resource, RawYamlDocument):
+            resource = yaml_load(resource.text)
+            if resource is None:
+                return
+
+        self.__stream.write(
+            json.dumps(resource, separators=(",", ":"), default=json_default)
+        )
+        self.__stream.write("\n")
+
+
+# Writes resources to a directory, one multi-document YAML file per argocd application.
+class SplitResultWriter:
+
+    INPUT_FILE = "input.yaml"
+    INDEX_FILE = "index.json"
+
+    def __init__(self, output_dir: str) -> None:
+        self.__output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Entries of the index by the application id.
+        self.__index: Dict[Union[str, None], dict] = {}
+
+        # Resources of an application are mostly written one after another,
+        # so only the file of the last application is kept open.
+        self.__app_id: Union[str, None] = None
+        self.__file: Union[TextIO, None] = None
+        self.__writer: Union[YamlResultWriter, None] = None
+
+    @classmethod
+    def file_name(cls, app_id: Union[str, None]) -> str:
+        if app_id is None:
+            return cls.INPUT_FILE
+        # Namespaces and names can't contain '_', so the names don't clash.
+        return urllib.parse.quote(app_id.replace("/", "_"), safe="") + ".yaml"
+
+    def write(
+        self, resource: Union[dict, RawYamlDocument], *, app_id: Union[str, None] = None
+    ) -> None:
+        entry = self.__index.setdefault(
+            app_id, {"app": app_id, "file": self.file_name(app_id), "resources": 0}
+        )
+
+        if self.__file is None or app_id != self.__app_id:
+            self.__close_file()
+
+            # The file is new only for the first resource of the application.
+            self.__file = open(
+                os.path.join(self.__output_dir, entry["file"]),
+                "a" if entry["resources"] else "w",
+            )
+            if entry["resources"]:
+                # Continue the multi-document stream of the file, the writer starts a new one.
+                self.__file.write("---\n")
+            self.__writer = YamlResultWriter(self.__file)
+            self.__app_id = app_id
+
+        self.__writer.write(resource)
+        entry["resources"] += 1
+
+    def close(self) -> None:
+        self.__close_file()
+
+        with open(os.path.join(self.__output_dir, self.INDEX_FILE), "w") as file:
+            json.dump({"files": list(self.__index.values())}, file, indent=1)
+            file.write("\n")
+
+    def __close_file(self) -> None:
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+            self.__writer = None
+
+
+ResultWriter = Union[YamlResultWriter, JsonLinesResultWriter, SplitResultWriter]
+
+
+# Open a writer of the result in the given format, see OUTPUT_FORMATS; '-' stands for stdout.
+@contextlib.contextmanager
+def open_result_writer(output: str, output_format: str) -> Iterator[ResultWriter]:
+    if output_format == "split":
+        if output == "-":
+            raise ValueError("The 'split' output format needs an output directory, not stdout")
+
+        result_writer = SplitResultWriter(output)
+        try:
+            yield result_writer
+        finally:
+            result_writer.close()
+        return
+
+    with open_output(output) as file:
+        if output_format == "jsonl":
+            yield JsonLinesResultWriter(file)
+        else:
+            yield YamlResultWriter(file)
+
+
+# Placeholder in the queue for a source that is being rendered by a worker thread.
+@dataclass(frozen=True)
+class PendingRender:
+
+    resource_ctx: ResourceCtx
+    log_records: List[LogRecord]
+    future: concurrent.futures.Future
+
+
+# Argocd applications found by a render and which application rendered which.
+class AppGraph:
+
+    def __init__(self, *, include: Tuple[AppFilter, ...], exclude: Tuple[AppFilter, ...]) -> None:
+        self.__include = include
+        self.__exclude = exclude
+        self.__lock = threading.Lock()
+        # Rendered applications: id -> (id of the parent application, whether included).
+        self.__apps: Dict[str, Tuple[Union[str, None], bool]] = {}
+        # The same for renders started ahead of time.
+        self.__prefetched_apps: Dict[str, Tuple[Union[str, None], bool]] = {}
+        self.edges: List[dict] = []
+        self.cycles: List[List[str]] = []
+        self.counts: Dict[str, int] = collections.Counter()
+
+    # Decide what to do with the application found in the result of parent_id (None for the input).
+    def visit(self, app: ArgocdApp, parent_id: Union[str, None]) -> str:
+        with self.__lock:
+            status, included = self.__decide(self.__apps.get, app, parent_id)
+
+            if status == "render":
+                self.__apps[app.id] = (parent_id, included)
+            elif status == "cycle":
+                self.cycles.append(self.__ancestry(self.__apps.get, parent_id) + [app.id])
+
+            self.edges.append({"parent": parent_id, "app": app.id, "status": status})
+            self.counts[status] += 1
+
+            return status
+
+    def should_prefetch(self, app: ArgocdApp, parent_id: Union[str, None]) -> bool:
+        def get_app(app_id: str) -> Union[Tuple[Union[str, None], bool], None]:
+            return self.__prefetched_apps.get(app_id) or self.__apps.get(app_id)
+
+        with self.__lock:
+            if app.id in self.__prefetched_apps:
+                return False
+
+            status, included = self.__decide(get_app, app, parent_id)
+            if status != "render":
+                return False
+
+            self.__prefetched_apps[app.id] = (parent_id, included)
+            return True
+
+    def __decide(
+        self,
+        get_app: Callable[[str], Union[Tuple[Union[str, None], bool], None]],
+        app: ArgocdApp,
+        parent_id: Union[str, None],
+    ) -> Tuple[str, bool]:
+        if app.id in self.__ancestry(get_app, parent_id):
+            return "cycle", False
+
+        if app.id in self.__apps:
+            return "duplicate", False
+
+        if any(app_filter.matches(app) for app_filter in self.__exclude):
+            return "excluded", False
+
+        parent = get_app(parent_id) if parent_id is not None else None
+        included = (
+            not self.__include
+            or (parent is not None and parent[1])
+            or any(app_filter.matches(app) for app_filter in self.__include)
+        )
+        if not included:
+            return "excluded", False
+
+        return "render", True
+
+    # Ids of the application and the applications above it, from the top.
+    @staticmethod
+    def __ancestry(
+        get_app: Callable[[str], Union[Tuple[Union[str, None], bool], None]],
+        app_id: Union[str, None],
+    ) -> List[str]:
+        ancestry = []
+        while app_id is not None and app_id not in ancestry:
+            ancestry.append(app_id)
+            parent = get_app(app_id)
+            app_id = parent[0] if parent is not None else None
+        return list(reversed(ancestry))
+
+    # Write the graph as json: the edges in the order of the result with their status, and the cycles.
+    def write(self, output_file: str) -> None:
+        try:
+            with open(output_file, "w") as f:
+                json.dump({"edges": self.edges, "cycles": self.cycles}, f, indent=1)
+                f.write("\n")
+        except OSError as e:
+            raise ValueError(f"Failed to write application graph to {repr(output_file)}") from e
+
+
+# Settings of the renderer that used to be given only on the command line.
+@dataclass(frozen=True)
+class RendererConfig:
+
+    repo_resolver: Union[str, None] = None
+    helm_args: Tuple[str, ...] = ()
+    kustomize_args: Tuple[str, ...] = ()
+    skip_non_yaml: bool = False
+
+
+# State kept between renderers of a long-running process (see the serve mode).
+class RendererSession:
+
+    def __init__(
+        self,
+        *,
+        config: Union[RendererConfig, None] = None,
+        render_cache: Union[RenderCache, None] = None,
+        parse_cache: Union[ParseCache, None] = None,
+        repo_ttl: Union[float, None] = None,
+        max_repos: Union[int, None] = None,
+        max_charts: Union[int, None] = None,
+        parse_workers: int = 0,
+    ) -> None:
+        self.config = config or RendererConfig()
+        self.render_cache = render_cache
+        self.parse_cache = parse_cache
+        self.parse_workers = parse_workers
+        self.__parse_pool: Union[concurrent.futures.ProcessPoolExecutor, None] = None
+        self.__lock = threading.Lock()
+        self.repo_resolutions = RepoResolutions(
+            self.config.repo_resolver, ttl=repo_ttl, max_entries=max_repos
+        )
+        self.chart_dependencies = ChartDependencies(
+            render_cache, ttl=repo_ttl, max_entries=max_charts
+        )
+
+    def __enter__(self) -> "RendererSession":
+        return self
+
+    def __exit__(self, *_exc_info) -> None:
+        self.close()
+
+    def stats(self) -> dict:
+        stats = {
+            "chart_dependencies": {
+                "built": self.chart_dependencies.built,
+                "reused": self.chart_dependencies.reused,
+            }
+        }
+
+        for name, cache in (
+            ("parse_cache", self.parse_cache),
+            ("render_cache", self.render_cache),
+        ):
+            if cache is not None:
+                stats[name] = {
+                    "hits": cache.hits,
+                    "misses": cache.misses,
+                    "evictions": cache.evictions,
+                }
+
+        if self.parse_cache is not None:
+            stats["parse_cache"]["size"] = self.parse_cache.size
+
+        return stats
+
+    # Pool of processes to parse files of directory sources, started on first use.
+    def parse_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self.__lock:
+            if self.__parse_pool is None:
+                # Forking a process with threads is not safe, the workers are started fresh.
+                self.__parse_pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.parse_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self.__parse_pool
+
+    def close(self) -> None:
+        self.repo_resolutions.close()
+        self.chart_dependencies.close()
+
+        with self.__lock:
+            if self.__parse_pool is not None:
+                self.__parse_pool.shutdown(wait=True)
+                self.__parse_pool = None
+
+
+# Directory sources with fewer files are parsed in the renderer process even with parse workers.
+PARALLEL_PARSE_MIN_FILES = 32
+# Number of files sent to a parse worker at once.
+PARALLEL_PARSE_CHUNK_FILES = 16
 
-        chart = get_str(resource, "chart", err_path=err_path, req=False)
-        if chart is None and path is None:
-            raise ValueError(f"Either 'chart' or 'path' must be given")
 
-        helm = get_dict(resource, "helm", err_path=err_path, req=False)
-        if helm is not None:
-            helm = ArgocdAppSourceHelm.from_resource(helm)
+# Renders argocd applications found in the given resources, recursively.
+class ArgocdRenderer:
 
-        if "kustomize" in resource:
-            raise ValueError(
-                f"Passing parameters via 'kustomize' dictionary is not supported"
+    def __init__(
+        self,
+        *,
+        config: Union[RendererConfig, None] = None,
+        session: Union[RendererSession, None] = None,
+        jobs: int = 1,
+        parse_workers: int = 0,
+        render_cache: Union[RenderCache, None] = None,
+        parse_cache: Union[ParseCache, None] = None,
+        order: str = "bfs",
+        raw_passthrough: bool = False,
+        profiler: Union[Profiler, None] = None,
+        incremental_state: Union[IncrementalState, None] = None,
+        include: Tuple[AppFilter, ...] = (),
+        exclude: Tuple[AppFilter, ...] = (),
+        plan: bool = False,
+    ) -> str:
+        if order not in ("bfs", "dfs"):
+            raise ValueError(f"Unknown order: {repr(order)}")
+
+        if session is None:
+            session = RendererSession(
+                config=config,
+                render_cache=render_cache,
+                parse_cache=parse_cache,
+                parse_workers=parse_workers,
             )
+            self.__owns_session = True
+        elif (
+            config is not None
+            or render_cache is not None
+            or parse_cache is not None
+            or parse_workers
+        ):
+            raise ValueError("The config, the caches and the parse workers are given by the session")
+        else:
+            self.__owns_session = False
+
+        self.__session = session
+        self.__config = session.config
+        self.__render_cache = session.render_cache
+        self.__parse_cache = session.parse_cache
+        self.__incremental_state = incremental_state
+        self.__source_digests = SourceDigests()
+        self.__repo_resolutions = session.repo_resolutions
+        self.__chart_dependencies = session.chart_dependencies
+        self.__order = order
+        self.__raw_passthrough = raw_passthrough
+        self.__profiler = profiler
+        self.__include = tuple(include)
+        self.__exclude = tuple(exclude)
+        # Graph of every render call, the current one is the last.
+        self.__app_graphs: List[AppGraph] = []
+        # Kinds of sources by the resolved repository path and the path of the source.
+        self.__source_kinds: Dict[Tuple[str, str], str] = {}
+        self.__source_kinds_lock = threading.Lock()
+        self.__plan = plan
+        # Sources of the plan mode, see write_plan.
+        self.plan: List[dict] = []
+        self.__pending_resources: Deque[
+            Union[ResourceCtx, PendingRender]
+        ] = collections.deque()
+        # Renders started before the application is reached in the queue, by id of the resource ctx.
+        # Worker threads add renders of the applications they have rendered.
+        self.__prefetched_renders: Dict[int, List[PendingRender]] = {}
+        self.__prefetched_renders_lock = threading.Lock()
+        # Source renders submitted to the workers and not processed yet, under the lock above.
+        self.__pending_renders = 0
+        # Renders of sources by their canonical key, see __render_deduplicated.
+        self.__source_renders: Dict[str, concurrent.futures.Future] = {}
+        self.__source_renders_lock = threading.Lock()
+        # Whether the result is kept in memory anyway, so renders of sources can be kept until the end.
+        # Otherwise a render is forgotten when its last resource (by id here) leaves the queue.
+        self.__keep_source_renders = False
+        self.__source_render_ends: Dict[int, str] = {}
+        self.__result_resources: List[ResourceCtx] = []
+        self.__result_writer: Union[ResultWriter, None] = None
+        self.__processing = False
+        self.__closed = False
+        # Counters of the progress, see progress().
+        self.__started = time.monotonic()
+        self.__applications_done = 0
+        self.__resources_done = 0
 
-        if "directory" in resource:
-            raise ValueError(f"'directory' settings are not supported")
+        self.deduplicated_renders = 0
 
-        return ArgocdAppSource(
-            repo_url=repo_url,
-            path=path,
-            target_revision=target_revision,
-            helm=helm,
-            chart=chart,
-            orig_resource=resource,
-        )
+        self.__repo_resolutions_generation = self.__repo_resolutions.acquire()
 
+        # The plan mode runs nothing expensive, but the plan is in order without workers.
+        if jobs > 1 and not plan:
+            self.__executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=jobs, thread_name_prefix=APP_NAME
+            )
+        else:
+            self.__executor = None
 
-@dataclass(frozen=True)
-class ArgocdApp:
-    src_file: str
-    id: str
-    name: str
-    namespace: Union[str, None]
-    destination_namespace: Union[str, None]
-    sources: List[ArgocdAppSource]
+    # Graph of the applications of the last processed file or render call.
+    @property
+    def app_graph(self) -> Union[AppGraph, None]:
+        return self.__app_graphs[-1] if self.__app_graphs else None
 
-    @staticmethod
-    def from_resource(resource_ctx: ResourceCtx) -> "ArgocdApp":
-        # Get required metadata or throw exception
-        resource = resource_ctx.resource
+    def __start_app_graph(self) -> None:
+        self.__app_graphs.append(AppGraph(include=self.__include, exclude=self.__exclude))
 
-        metadata = get_dict(resource, "metadata", err_path="", req=True)
-        name = get_str(metadata, "name", err_path=".metadata", req=True)
+    def __profile(self, stage: str) -> ContextManager:
+        if self.__profiler is None:
+            return contextlib.nullcontext()
+        return self.__profiler.stage(stage)
 
-        namespace = (
-            get_str(metadata, "namespace", err_path=".metadata", req=False)
-            or resource_ctx.target_namespace
-        )
+    def __enter__(self) -> "ArgocdRenderer":
+        return self
 
-        spec = get_dict(resource, "spec", err_path="", req=True)
+    def __exit__(self, *_exc_info) -> None:
+        self.close()
 
-        sources = get_list(spec, "sources", err_path=".spec", req=False)
-        source = get_dict(spec, "source", err_path=".spec", req=False)
+    def close(self) -> None:
+        if self.__closed:
+            return
+        self.__closed = True
 
-        if source is not None and sources is not None:
-            raise ValueError("Only one of .spec.source or .spec.sources must be given")
+        if self.__executor is not None:
+            for pending in self.__pending_resources:
+                if isinstance(pending, PendingRender):
+                    pending.future.cancel()
 
-        if source is not None:
-            sources = [source]
+            with self.__prefetched_renders_lock:
+                for renders in self.__prefetched_renders.values():
+                    for pending in renders:
+                        pending.future.cancel()
 
-        sources = [ArgocdAppSource.from_resource(source) for source in sources]
+            self.__executor.shutdown(wait=True)
+            self.__executor = None
 
-        destination = get_dict(spec, "destination", err_path=".spec", req=False) or {}
-        destination_namespace = get_str(
-            destination, "namespace", err_path=".spec.destination", req=False
-        )
+        self.__repo_resolutions.release(self.__repo_resolutions_generation)
 
-        return ArgocdApp(
-            id=f"{namespace or ''}/{name}" or name,
-            name=name,
-            namespace=namespace,
-            sources=sources,
-            destination_namespace=destination_namespace,
-            src_file=resource_ctx.origin,
-        )
+        if self.__owns_session:
+            self.__session.close()
 
+    # Render the inputs one after another, writing the result of each input while the next ones render.
+    def process_batch(self, entries: List[BatchEntry], *, writers: int = 1) -> None:
+        if self.__processing:
+            raise ValueError("The renderer is already processing resources")
+
+        def write(entry: BatchEntry, resource_ctxs: List[ResourceCtx]) -> None:
+            try:
+                with open_result_writer(
+                    entry.output_file, entry.output_format
+                ) as result_writer, self.__profile("dump"):
+                    for resource_ctx in resource_ctxs:
+                        result_writer.write(resource_ctx.resource, app_id=resource_ctx.app_id)
+            except Exception as e:
+                raise ValueError(
+                    f"Failed to write result to {repr(entry.output_file)}"
+                ) from e
+
+            log(f"Written result of {repr(entry.resources_file)} to {repr(entry.output_file)}.")
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=writers, thread_name_prefix="writer"
+        ) as executor:
+            pending_writes: Deque[concurrent.futures.Future] = collections.deque()
+
+            for i, entry in enumerate(entries):
+                log(f"Batch input {i + 1} of {len(entries)}: {repr(entry.resources_file)}...")
+                log("")
+
+                self.__start_app_graph()
+                self.__queue(
+                    self.__make_resource_ctxs(
+                        resources=self.__parse_yaml_file(entry.resources_file),
+                        target_namespace=entry.target_namespace,
+                        origin=Origin(entry.resources_file),
+                    ),
+                    front=False,
+                )
+                self.__keep_source_renders = True
+                try:
+                    resource_ctxs = list(self.__process_pending_resources())
+                finally:
+                    self.__keep_source_renders = False
+                    self.__forget_source_renders()
 
-# ################################################################################################
-# Renderer.
+                # Results wait in memory until written, so don't let them pile up.
+                while len(pending_writes) >= writers:
+                    pending_writes.popleft().result()
 
+                pending_writes.append(executor.submit(write, entry, resource_ctxs))
 
-class ArgocdRenderer:
-    def __init__(self) -> str:
-        self.__pending_resources: List[ResourceCtx] = []
-        self.__result_resources: List[dict] = []
-        self.__processing = False
-        pass
+            while pending_writes:
+                pending_writes.popleft().result()
+
+        log("")
 
     def process_file(
         self, *, resources_file: str, target_namespace: Union[str, None]
     ) -> "ArgocdRenderer":
-        self.__queue_resources_for_processing(
-            resources=parse_yaml_file(resources_file),
-            target_namespace=target_namespace,
-            origin=resources_file,
+        if not self.__processing:
+            self.__start_app_graph()
+
+        self.__queue(
+            self.__make_resource_ctxs(
+                resources=self.__parse_yaml_file(resources_file),
+                target_namespace=target_namespace,
+                origin=Origin(resources_file),
+            ),
+            front=False,
         )
 
         if self.__processing:
             return
 
+        self.__keep_source_renders = self.__result_writer is None
+        try:
+            for resource_ctx in self.__process_pending_resources():
+                self.__output_resource(resource_ctx)
+        finally:
+            self.__keep_source_renders = False
+
+        return self
+
+    # Render the given resources (YAML text or parsed documents), yield the result resources in order.
+    def render(
+        self,
+        resources: Union[str, List[any]],
+        *,
+        target_namespace: Union[str, None] = None,
+        origin: str = "<input>",
+    ) -> Iterator[Union[dict, RawYamlDocument]]:
+        if self.__processing:
+            raise ValueError("The renderer is already processing resources")
+
+        if isinstance(resources, str):
+            with self.__profile("parse"):
+                resources = parse_yaml_text(
+                    resources, origin=origin, raw_passthrough=self.__raw_passthrough
+                )
+
+        self.__start_app_graph()
+        self.__queue(
+            self.__make_resource_ctxs(
+                resources=resources, target_namespace=target_namespace, origin=Origin(origin)
+            ),
+            front=False,
+        )
+
+        for resource_ctx in self.__process_pending_resources():
+            yield resource_ctx.resource
+
+    # Process queued resources until the queue is empty, yield the resources to output.
+    def __process_pending_resources(self) -> Iterator[ResourceCtx]:
         self.__processing = True
 
         try:
             while self.__pending_resources:
-                resource = self.__pending_resources.pop(0)
+                resource = self.__pending_resources.popleft()
+
+                if self.__source_render_ends:
+                    self.__forget_source_render(id(resource))
 
                 try:
-                    self.__process_resource(resource)
+                    if isinstance(resource, PendingRender):
+                        self.__process_pending_render(resource)
+                    else:
+                        for resource_ctx in self.__process_resource(resource):
+                            self.__resources_done += 1
+                            yield resource_ctx
                 except Exception as e:
+                    if isinstance(resource, PendingRender):
+                        resource = resource.resource_ctx
+
                     resource_yaml = dump_as_yaml_for_debug(
                         resource.resource, indent="    "
                     )
@@ -306,59 +2329,259 @@ class ArgocdRenderer:
                         f"Failed to process the following resource from {repr(resource.origin)}:\n{resource_yaml}"
                     ) from e
         finally:
+            # After a failure or when the caller stops early, nothing may be left for the next call.
+            self.__drop_pending_resources()
+            if not self.__keep_source_renders:
+                self.__forget_source_renders()
             self.__processing = False
 
-        return self
+    def __forget_source_render(self, resource_id: int) -> None:
+        with self.__source_renders_lock:
+            key = self.__source_render_ends.pop(resource_id, None)
+            if key is not None:
+                del self.__source_renders[key]
+
+    def __forget_source_renders(self) -> None:
+        with self.__source_renders_lock:
+            self.__source_renders.clear()
+            self.__source_render_ends.clear()
+
+    def __drop_pending_resources(self) -> None:
+        pending_renders = [
+            pending for pending in self.__pending_resources if isinstance(pending, PendingRender)
+        ]
+        self.__pending_resources.clear()
+
+        # Running renders prefetch the children they render, so wait for them until nothing is left.
+        while True:
+            with self.__prefetched_renders_lock:
+                for renders in self.__prefetched_renders.values():
+                    pending_renders += renders
+                self.__prefetched_renders.clear()
+                self.__pending_renders = 0
+
+            if not pending_renders:
+                break
+
+            for pending in pending_renders:
+                pending.future.cancel()
+            concurrent.futures.wait([pending.future for pending in pending_renders])
+            pending_renders = []
+
+    def __process_pending_render(self, pending: PendingRender) -> None:
+        try:
+            rendered_resources = pending.future.result()
+        finally:
+            write_log_records(pending.log_records)
+            with self.__prefetched_renders_lock:
+                self.__pending_renders -= 1
+
+        # Rendered resources must be processed before anything queued after the placeholder.
+        self.__queue(rendered_resources, front=True)
+
+    def __queue(
+        self, items: List[Union[ResourceCtx, PendingRender]], *, front: bool
+    ) -> None:
+        if self.__executor is not None:
+            for item in items:
+                if isinstance(item, ResourceCtx):
+                    self.__prefetch_argocd_application_renders(item)
+
+        if front:
+            self.__pending_resources.extendleft(reversed(items))
+        else:
+            self.__pending_resources.extend(items)
+
+    # Start rendering sources of the application right away, without waiting for its turn in the queue.
+    def __prefetch_argocd_application_renders(self, resource_ctx: ResourceCtx) -> None:
+        resource = resource_ctx.resource
+        if (
+            type(resource) is not dict
+            or resource.get("apiVersion") != "argoproj.io/v1alpha1"
+            or resource.get("kind") != "Application"
+        ):
+            return
+
+        try:
+            app = ArgocdApp.from_resource(resource_ctx)
+        except Exception:
+            # The error is reported when the application is processed in its turn.
+            return
+
+        with self.__prefetched_renders_lock:
+            if id(resource_ctx) in self.__prefetched_renders:
+                return
+            if not self.app_graph.should_prefetch(app, resource_ctx.app_id):
+                return
+            renders = self.__submit_renders(resource_ctx, app)
+            self.__prefetched_renders[id(resource_ctx)] = renders
+            self.__pending_renders += len(renders)
+
+    def __make_resource_ctxs(
+        self,
+        *,
+        resources: List[any],
+        target_namespace: Union[str, None],
+        origin: Origin,
+        app_id: Union[str, None] = None,
+    ) -> List[ResourceCtx]:
+        resource_ctxs = []
 
-    def __queue_resources_for_processing(
-        self, *, resources: List[any], target_namespace: Union[str, None], origin: str
-    ) -> "ArgocdRenderer":
         for resource in resources:
             if resource is None:
                 continue
 
-            if type(resource) is not dict:
+            if type(resource) is not dict and not isinstance(
+                resource, RawYamlDocument
+            ):
                 raise ValueError(
                     f"The resource must be a dictionary, got {repr(resource)} in {repr(origin)}."
                 )
 
-            self.__pending_resources.append(
+            resource_ctxs.append(
                 ResourceCtx(
                     target_namespace=target_namespace,
                     resource=resource,
                     origin=origin,
+                    app_id=app_id,
                 )
             )
 
-        return self
+        return resource_ctxs
 
-    def __queue_all_resource_files_in_dir_rec(
-        self, *, base_dir: str, dir_origin: str, target_namespace: Union[str, None]
-    ) -> None:
-        walk = list(os.walk(base_dir))
-        walk.sort(key=lambda x: x[0])
+    def __make_resource_ctxs_for_all_files_in_dir_rec(
+        self,
+        *,
+        base_dir: str,
+        dir_origin: Origin,
+        target_namespace: Union[str, None],
+        app_id: str,
+    ) -> List[ResourceCtx]:
+        resource_ctxs = []
+
+        with self.__profile("walk"):
+            file_paths = list_files_in_dir_rec(
+                base_dir,
+                extensions=YAML_FILE_EXTENSIONS if self.__config.skip_non_yaml else None,
+            )
+
+        if self.__session.parse_workers and len(file_paths) >= PARALLEL_PARSE_MIN_FILES:
+            parsed_outputs = self.__parse_yaml_files_in_workers(file_paths)
+        else:
+            parsed_outputs = map(self.__parse_yaml_file, file_paths)
+
+        for file_path, parsed_output in zip(file_paths, parsed_outputs):
+            base_rel_file_path = os.path.relpath(file_path, base_dir)
+
+            log(
+                f"    ... found {len(parsed_output)} resources in {repr(base_rel_file_path)}.",
+                level="debug",
+                event="file",
+                file=base_rel_file_path,
+                resources=len(parsed_output),
+            )
+            resource_ctxs += self.__make_resource_ctxs(
+                resources=parsed_output,
+                target_namespace=target_namespace,
+                origin=dir_origin.child(base_rel_file_path),
+                app_id=app_id,
+            )
+
+        return resource_ctxs
 
-        for file_dir, _, files in walk:
-            files = list(files)
-            files.sort()
+    # Parse the files in the pool of worker processes, files found in the parse cache are not sent there.
+    def __parse_yaml_files_in_workers(self, yaml_files: List[str]) -> List[List[any]]:
+        results: List[Union[List[any], None]] = [None] * len(yaml_files)
+        keys: List[Union[tuple, None]] = [None] * len(yaml_files)
 
-            for file in files:
-                file_path = os.path.join(file_dir, file)
+        with self.__profile("parse"):
+            if self.__parse_cache is not None:
+                for i, yaml_file in enumerate(yaml_files):
+                    keys[i], results[i] = self.__parse_cache.lookup(
+                        yaml_file, raw_passthrough=self.__raw_passthrough
+                    )
 
-                parsed_output = parse_yaml_file(file_path)
-                base_rel_file_path = os.path.relpath(file_path, base_dir)
+            missing = [i for i, result in enumerate(results) if result is None]
+            chunks = [
+                missing[start : start + PARALLEL_PARSE_CHUNK_FILES]
+                for start in range(0, len(missing), PARALLEL_PARSE_CHUNK_FILES)
+            ]
+            yaml_backend = "python" if yaml_loader is yaml.FullLoader else "libyaml"
+
+            chunk_results = self.__session.parse_pool().map(
+                parse_yaml_files_in_worker,
+                [[yaml_files[i] for i in chunk] for chunk in chunks],
+                [yaml_backend] * len(chunks),
+                [self.__raw_passthrough] * len(chunks),
+            )
 
-                print(
-                    f"    ... found {len(parsed_output)} resources in {repr(base_rel_file_path)}."
+            for chunk, chunk_result in zip(chunks, chunk_results):
+                for i, docs in zip(chunk, chunk_result):
+                    if docs is None:
+                        # Parse again here to raise the complete error.
+                        docs = parse_yaml_file(
+                            yaml_files[i], raw_passthrough=self.__raw_passthrough
+                        )
+
+                    results[i] = docs
+                    if self.__parse_cache is not None:
+                        self.__parse_cache.store(keys[i], docs)
+
+        return results
+
+    def __parse_yaml_file(self, yaml_file: str) -> List[any]:
+        with self.__profile("parse"):
+            if self.__parse_cache is None:
+                return parse_yaml_file(
+                    yaml_file, raw_passthrough=self.__raw_passthrough
                 )
-                self.__queue_resources_for_processing(
-                    resources=parsed_output,
-                    target_namespace=target_namespace,
-                    origin=dir_origin + " / " + base_rel_file_path,
+
+            return self.__parse_cache.parse_file(
+                yaml_file, raw_passthrough=self.__raw_passthrough
+            )
+
+    def __make_resource_ctxs_for_rendered_files(
+        self,
+        *,
+        rendered_files: List[Tuple[Union[str, None], str]],
+        origin: Origin,
+        target_namespace: Union[str, None],
+        app_id: str,
+    ) -> List[ResourceCtx]:
+        resource_ctxs = []
+
+        for rel_file_path, text in rendered_files:
+            file_origin = origin if rel_file_path is None else origin.child(rel_file_path)
+            with self.__profile("parse"):
+                parsed_output = parse_yaml_text(
+                    text, origin=str(file_origin), raw_passthrough=self.__raw_passthrough
+                )
+
+            if rel_file_path is not None:
+                log(
+                    f"    ... found {len(parsed_output)} resources in {repr(rel_file_path)}.",
+                    level="debug",
+                    event="file",
+                    file=rel_file_path,
+                    resources=len(parsed_output),
                 )
 
-    def __process_resource(self, resource_ctx: ResourceCtx) -> None:
+            resource_ctxs += self.__make_resource_ctxs(
+                resources=parsed_output,
+                target_namespace=target_namespace,
+                origin=file_origin,
+                app_id=app_id,
+            )
+
+        return resource_ctxs
+
+    def __process_resource(self, resource_ctx: ResourceCtx) -> Iterator[ResourceCtx]:
         resource = resource_ctx.resource
+        if isinstance(resource, RawYamlDocument):
+            # Not an argocd application, so the only thing to do is to output it.
+            yield resource_ctx
+            return
+
         if type(resource) is not dict:
             raise ValueError(
                 f"The resource must be a dictionary, but got '{repr(resource)}'"
@@ -367,53 +2590,176 @@ class ArgocdRenderer:
         api_version = get_str(resource, "apiVersion", err_path="", req=False)
         kind = get_str(resource, "kind", err_path="", req=False)
 
-        self.__result_resources.append(resource)
+        yield resource_ctx
 
         if api_version == "argoproj.io/v1alpha1" and kind == "Application":
             self.__process_argocd_application(resource_ctx)
 
+    def __output_resource(self, resource_ctx: ResourceCtx) -> None:
+        if self.__result_writer is None:
+            self.__result_resources.append(resource_ctx)
+        else:
+            with self.__profile("dump"):
+                self.__result_writer.write(
+                    resource_ctx.resource, app_id=resource_ctx.app_id
+                )
+
     def __process_argocd_application(self, resource_ctx: ResourceCtx) -> None:
         app = ArgocdApp.from_resource(resource_ctx)
 
-        print(
-            f"Processing argocd application {repr(app.id)} from {repr(resource_ctx.origin)}..."
+        log(
+            f"Processing argocd application {repr(app.id)} from {repr(resource_ctx.origin)}...",
+            event="application",
+            app=app.id,
+            origin=resource_ctx.origin,
+        )
+
+        with self.__prefetched_renders_lock:
+            renders = self.__prefetched_renders.pop(id(resource_ctx), None)
+
+        app_graph = self.app_graph
+        status = app_graph.visit(app, resource_ctx.app_id)
+        if status != "render":
+            if renders is not None:
+                with self.__prefetched_renders_lock:
+                    self.__pending_renders -= len(renders)
+
+            if status == "excluded":
+                log("  Skipping, excluded by the filters.", event="skip", app=app.id, reason=status)
+            elif status == "duplicate":
+                log(
+                    "  Skipping, an application with the same id is already rendered.",
+                    event="skip",
+                    app=app.id,
+                    reason=status,
+                )
+            else:
+                log(
+                    f"  Skipping, cycle of applications: {' -> '.join(app_graph.cycles[-1])}.",
+                    level="warning",
+                    event="skip",
+                    app=app.id,
+                    reason=status,
+                )
+            log("")
+            self.__applications_done += 1
+            return
+
+        if renders is None:
+            if self.__executor is None:
+                renders = []
+                for source_index, source in enumerate(app.sources):
+                    renders += self.__render_argocd_application_source(
+                        resource_ctx, app, source_index, source
+                    )
+            else:
+                renders = self.__submit_renders(resource_ctx, app)
+                with self.__prefetched_renders_lock:
+                    self.__pending_renders += len(renders)
+
+        self.__applications_done += 1
+        self.__queue(renders, front=self.__order == "dfs")
+
+    def __submit_renders(
+        self, resource_ctx: ResourceCtx, app: ArgocdApp
+    ) -> List[PendingRender]:
+        renders = []
+
+        for source_index, source in enumerate(app.sources):
+            log_records = []
+            future = self.__executor.submit(
+                self.__render_argocd_application_source_in_worker,
+                log_records,
+                resource_ctx,
+                app,
+                source_index,
+                source,
+            )
+            renders.append(
+                PendingRender(
+                    resource_ctx=resource_ctx, log_records=log_records, future=future
+                )
+            )
+
+        return renders
+
+    def __render_argocd_application_source_in_worker(
+        self,
+        log_records: List[LogRecord],
+        resource_ctx: ResourceCtx,
+        app: ArgocdApp,
+        source_index: int,
+        source: ArgocdAppSource,
+    ) -> List[ResourceCtx]:
+        log_buffer.records = log_records
+        try:
+            resource_ctxs = self.__render_argocd_application_source(
+                resource_ctx, app, source_index, source
+            )
+        finally:
+            log_buffer.records = None
+
+        # Start rendering child applications right away, they don't depend on anything else.
+        for child_resource_ctx in resource_ctxs:
+            self.__prefetch_argocd_application_renders(child_resource_ctx)
+
+        return resource_ctxs
+
+    def __render_argocd_application_source(
+        self,
+        resource_ctx: ResourceCtx,
+        app: ArgocdApp,
+        source_index: int,
+        source: ArgocdAppSource,
+    ) -> List[ResourceCtx]:
+        log(
+            f"  Source:  {repr(source.repo_url)} @ {repr(source.target_revision)}  /  {repr(source.path or source.chart)}",
+            event="source",
+            app=app.id,
+            repo_url=source.repo_url,
+            target_revision=source.target_revision,
+            path=source.path or source.chart,
         )
 
-        for source in app.sources:
-            print(
-                f"  Source:  {repr(source.repo_url)} @ {repr(source.target_revision)}  /  {repr(source.path or source.chart)}"
+        if self.__profiler is None:
+            profiler_scope = contextlib.nullcontext()
+        else:
+            profiler_scope = self.__profiler.scope(
+                app=app.id,
+                source=f"{source.repo_url} @ {source.target_revision} / {source.path or source.chart}",
             )
 
-            with tempfile.TemporaryDirectory(prefix=APP_NAME) as temp_dir:
-                make_secure(temp_dir)
+        # Most sources don't need a temporary directory, it's created only when used.
+        with LazyTempDir(prefix=APP_NAME) as temp_dir, profiler_scope:
+            try:
+                resource_ctxs = self.__process_argocd_application_source(
+                    resource_ctx, app, source_index, source, temp_dir
+                )
+            except Exception as e:
+                resource_yaml = dump_as_yaml_for_debug(
+                    source.orig_resource, indent="    "
+                )
+                raise ValueError(
+                    f"Failed to process argocd application source:\n{resource_yaml}"
+                ) from e
 
-                try:
-                    self.__process_argocd_application_source(
-                        resource_ctx, app, source, temp_dir
-                    )
-                except Exception as e:
-                    resource_yaml = dump_as_yaml_for_debug(
-                        source.orig_resource, indent="    "
-                    )
-                    raise ValueError(
-                        f"Failed to process argocd application source:\n{resource_yaml}"
-                    ) from e
+        log("")
 
-            print("")
+        return resource_ctxs
 
     def __process_argocd_application_source(
         self,
         resource_ctx: ResourceCtx,
         app: ArgocdApp,
+        source_index: int,
         source: ArgocdAppSource,
-        temp_dir: str,
-    ) -> None:
+        temp_dir: LazyTempDir,
+    ) -> List[ResourceCtx]:
         if source.chart is None:
-            resolved_repo_path = resolve_repo(
-                url=source.repo_url,
-                revision=source.target_revision,
-                temp_dir=temp_dir,
-            )
+            with self.__profile("resolve"):
+                resolved_repo_path = self.__repo_resolutions.resolve(
+                    url=source.repo_url, revision=source.target_revision
+                )
             if resolved_repo_path == "":
                 raise ValueError(f"Failed to resolve the repository path...")
         else:
@@ -422,15 +2768,7 @@ class ArgocdRenderer:
         if source.helm is not None or source.chart is not None:
             kind = "helm"
         else:
-            kind = None
-            if resolved_repo_path != "":
-                src_dir = resolved_repo_path + "/" + source.path
-                if os.path.exists(os.path.join(src_dir, "Chart.yaml")):
-                    kind = "helm"
-                elif os.path.exists(os.path.join(src_dir, "kustomization.yaml")):
-                    kind = "kustomize"
-                else:
-                    kind = "simple"
+            kind = self.__source_kind(resolved_repo_path, source.path)
 
         if kind == "helm":
             if source.helm is None:
@@ -449,133 +2787,865 @@ class ArgocdRenderer:
                 f"Unknown/unsupported source type in argocd application {repr(app.id)} in {repr(resource_ctx.origin)}"
             )
 
-        handler(resource_ctx, app, source, temp_dir, resolved_repo_path)
+        def render_source() -> List[ResourceCtx]:
+            return handler(resource_ctx, app, source, temp_dir, resolved_repo_path)
+
+        def render() -> List[ResourceCtx]:
+            return self.__render_deduplicated(
+                resource_ctx,
+                kind,
+                app,
+                source,
+                resolved_repo_path,
+                (
+                    (lambda: self.__render_planned(kind, app, source, resolved_repo_path, render_source))
+                    if self.__plan
+                    else render_source
+                ),
+            )
+
+        if self.__incremental_state is None:
+            return render()
+
+        fingerprint = self.__source_fingerprint(
+            resource_ctx, kind, app, source, resolved_repo_path
+        )
+        resource_ctxs = self.__incremental_state.lookup(
+            app.id, source_index, fingerprint
+        )
+        if resource_ctxs is None:
+            resource_ctxs = render()
+        else:
+            log(
+                f"    Unchanged since the previous run, reusing {len(resource_ctxs)} resources...",
+                event="reuse",
+                app=app.id,
+                reason="unchanged",
+                resources=len(resource_ctxs),
+            )
+            self.__add_plan_entry(kind, app, source, "unchanged")
+
+        if not self.__plan:
+            # A plan doesn't render everything, so it must not be taken for the result next time.
+            self.__incremental_state.record(app.id, source_index, fingerprint, resource_ctxs)
+
+        return resource_ctxs
+
+    # Kind of a source without helm settings by the files of its directory, known once per run.
+    def __source_kind(self, resolved_repo_path: str, path: str) -> str:
+        key = (resolved_repo_path, path)
+
+        with self.__source_kinds_lock:
+            kind = self.__source_kinds.get(key)
+
+        if kind is None:
+            src_dir = resolved_repo_path + "/" + path
+            if os.path.exists(os.path.join(src_dir, "Chart.yaml")):
+                kind = "helm"
+            elif os.path.exists(os.path.join(src_dir, "kustomization.yaml")):
+                kind = "kustomize"
+            else:
+                kind = "simple"
+
+            with self.__source_kinds_lock:
+                self.__source_kinds[key] = kind
+
+        return kind
+
+    # In the plan mode, render only what doesn't need to run helm or kubectl.
+    def __render_planned(
+        self,
+        kind: str,
+        app: ArgocdApp,
+        source: ArgocdAppSource,
+        resolved_repo_path: str,
+        render: Callable[[], List[ResourceCtx]],
+    ) -> List[ResourceCtx]:
+        if kind == "simple":
+            status = "read"
+        elif self.__render_cache is not None and self.__render_cache.contains(
+            self.__source_render_cache_key(kind, app, source, resolved_repo_path)
+        ):
+            status = "cached"
+        else:
+            status = "run"
+
+        self.__add_plan_entry(kind, app, source, status)
+
+        if status == "run":
+            return []
+
+        return render()
+
+    def __source_render_cache_key(
+        self, kind: str, app: ArgocdApp, source: ArgocdAppSource, resolved_repo_path: str
+    ) -> str:
+        if kind == "kustomize":
+            return self.__kustomize_render_key(resolved_repo_path + "/" + source.path)
+
+        chart_path, helm_cwd = self.__helm_chart_location(source, resolved_repo_path)
+        return self.__helm_render_key(app, source, chart_path, helm_cwd)
+
+    def __add_plan_entry(
+        self, kind: str, app: ArgocdApp, source: ArgocdAppSource, status: str
+    ) -> None:
+        if not self.__plan:
+            return
+
+        tool = PLAN_TOOLS.get(kind) if status == "run" else None
+        log(
+            f"    Plan: {kind} source, {status}{f' ({tool})' if tool else ''}.",
+            event="plan",
+            app=app.id,
+            kind=kind,
+            status=status,
+            tool=tool,
+        )
+
+        self.plan.append(
+            {
+                "app": app.id,
+                "repo_url": source.repo_url,
+                "target_revision": source.target_revision,
+                "path": source.path,
+                "chart": source.chart,
+                "kind": kind,
+                "status": status,
+                "tool": tool,
+            }
+        )
+
+    # Render the source, or take the result of an identical source rendered in this run.
+    def __render_deduplicated(
+        self,
+        resource_ctx: ResourceCtx,
+        kind: str,
+        app: ArgocdApp,
+        source: ArgocdAppSource,
+        resolved_repo_path: str,
+        render: Callable[[], List[ResourceCtx]],
+    ) -> List[ResourceCtx]:
+        key = self.__source_render_key(kind, app, source, resolved_repo_path)
+        app_origin = resource_ctx.origin.child(app.id)
+
+        with self.__source_renders_lock:
+            future = self.__source_renders.get(key)
+            if future is None:
+                self.__source_renders[key] = concurrent.futures.Future()
+
+        if future is None:
+            future = self.__source_renders[key]
+            try:
+                resource_ctxs = render()
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+
+            future.set_result((app_origin, resource_ctxs))
+
+            # The resources are only held by the queue until they are written, unless all are kept.
+            if resource_ctxs and not self.__keep_source_renders:
+                with self.__source_renders_lock:
+                    self.__source_render_ends[id(resource_ctxs[-1])] = key
+
+            return resource_ctxs
+
+        rendered_app_origin, rendered_resource_ctxs = future.result()
+
+        log(
+            f"    Same as a source rendered before, reusing its {len(rendered_resource_ctxs)} resources...",
+            event="reuse",
+            app=app.id,
+            reason="identical",
+            resources=len(rendered_resource_ctxs),
+        )
+        self.__add_plan_entry(kind, app, source, "identical")
+        with self.__source_renders_lock:
+            self.deduplicated_renders += 1
+
+        # Resources of a file have the same origin, keep it shared.
+        origins: Dict[int, Origin] = {}
+        resource_ctxs = []
+        for rendered_resource_ctx in rendered_resource_ctxs:
+            rendered_origin = rendered_resource_ctx.origin
+            origin = origins.get(id(rendered_origin))
+            if origin is None:
+                origin = rendered_origin.rebase(rendered_app_origin, app_origin)
+                origins[id(rendered_origin)] = origin
+
+            resource_ctxs.append(
+                dataclasses.replace(rendered_resource_ctx, origin=origin, app_id=app.id)
+            )
+
+        return resource_ctxs
+
+    # Canonical key of everything the rendered resources of a source depend on, but origins.
+    def __source_render_key(
+        self,
+        kind: str,
+        app: ArgocdApp,
+        source: ArgocdAppSource,
+        resolved_repo_path: str,
+    ) -> str:
+        components = {
+            "kind": kind,
+            "repo_url": source.repo_url,
+            "target_revision": source.target_revision,
+            "resolved_repo_path": resolved_repo_path,
+            "path": source.path,
+            "chart": source.chart,
+            "namespace": app.destination_namespace,
+        }
+
+        if kind == "helm":
+            components.update(
+                values=source.helm.values,
+                value_files=source.helm.value_files,
+                file_parameters=[list(p) for p in source.helm.file_parameters],
+                release_name=source.helm.release_name or app.name,
+            )
+
+        return make_digest_key(components)
+
+    def __source_fingerprint(
+        self,
+        resource_ctx: ResourceCtx,
+        kind: str,
+        app: ArgocdApp,
+        source: ArgocdAppSource,
+        resolved_repo_path: str,
+    ) -> str:
+        if kind == "helm":
+            chart_path, helm_cwd = self.__helm_chart_location(source, resolved_repo_path)
+            render_key = self.__helm_render_key(app, source, chart_path, helm_cwd)
+        elif kind == "kustomize":
+            render_key = self.__kustomize_render_key(resolved_repo_path + "/" + source.path)
+        else:
+            render_key = make_digest_key(
+                {
+                    "source_tree": self.__source_digests.tree_digest(
+                        resolved_repo_path + "/" + source.path
+                    ),
+                    "skip_non_yaml": self.__config.skip_non_yaml,
+                }
+            )
+
+        return make_digest_key(
+            {
+                "origin": str(resource_ctx.origin),
+                "target_namespace": resource_ctx.target_namespace,
+                "resource": resource_ctx.resource,
+                "render": render_key,
+                # Resources kept as text are reused as text.
+                "raw_passthrough": self.__raw_passthrough,
+            }
+        )
 
     def __process_argocd_application_simple_source(
         self,
         resource_ctx: ResourceCtx,
         app: ArgocdApp,
         source: ArgocdAppSource,
-        _temp_dir: str,
+        _temp_dir: LazyTempDir,
         resolved_repo_path,
-    ) -> None:
-        print("    Using resource from the directory as-is...", flush=True)
-        self.__queue_all_resource_files_in_dir_rec(
+    ) -> List[ResourceCtx]:
+        log("    Using resource from the directory as-is...", flush=True)
+        resource_ctxs = self.__make_resource_ctxs_for_all_files_in_dir_rec(
             base_dir=resolved_repo_path + "/" + source.path,
-            dir_origin=resource_ctx.origin + " / " + app.id,
+            dir_origin=resource_ctx.origin.child(app.id),
             target_namespace=app.destination_namespace,
+            app_id=app.id,
         )
 
-        print("    Done.")
-        print("")
+        log("    Done.")
+        log("")
+
+        return resource_ctxs
 
     def __process_argocd_application_kustomize_source(
         self,
         resource_ctx: ResourceCtx,
         app: ArgocdApp,
         source: ArgocdAppSource,
-        _temp_dir: str,
+        _temp_dir: LazyTempDir,
         resolved_repo_path,
-    ) -> None:
-        print("    Preparing to process with kubectl kustomize...", flush=True)
+    ) -> List[ResourceCtx]:
+        log("    Preparing to process with kubectl kustomize...", flush=True)
+
+        kustomization_path = resolved_repo_path + "/" + source.path
 
         kustomize_args = ["kubectl", "kustomize"]
-        kustomize_args += additional_kustomize_args or []
-        kustomize_args.append(resolved_repo_path + "/" + source.path)
+        kustomize_args += self.__config.kustomize_args
+        kustomize_args.append(kustomization_path)
+
+        cache_key = None
+        if self.__render_cache is not None:
+            cache_key = self.__kustomize_render_key(kustomization_path)
+        rendered_files = self.__render_cache.get(cache_key) if cache_key else None
 
-        print("    Rendering using kubectl kustomize...", flush=True)
-        output = exec_capture_output(kustomize_args)
+        if rendered_files is None:
+            log("    Rendering using kubectl kustomize...", flush=True)
+            with self.__profile("kustomize"):
+                rendered_files = [(None, exec_capture_output(kustomize_args))]
 
-        self.__queue_resources_for_processing(
-            resources=yaml.full_load_all(output),
+            if cache_key:
+                self.__render_cache.put(cache_key, rendered_files)
+        else:
+            log("    Using cached output of kubectl kustomize...", flush=True)
+
+        resource_ctxs = self.__make_resource_ctxs_for_rendered_files(
+            rendered_files=rendered_files,
+            origin=resource_ctx.origin.child(app.id),
             target_namespace=app.destination_namespace,
-            origin=resource_ctx.origin + " / " + app.id,
+            app_id=app.id,
         )
 
-        print("    Done.")
-        print("")
+        log("    Done.")
+        log("")
+
+        return resource_ctxs
 
     def __process_argocd_application_helm_source(
         self,
         resource_ctx: ResourceCtx,
         app: ArgocdApp,
         source: ArgocdAppSource,
-        temp_dir: str,
+        temp_dir: LazyTempDir,
         resolved_repo_path,
-    ) -> None:
-        print("    Preparing to process with helm...", flush=True)
+    ) -> List[ResourceCtx]:
+        log("    Preparing to process with helm...", flush=True)
 
-        # Write values file.
-        values_file = os.path.join(temp_dir, "values.yaml")
-        with open(values_file, "w") as file:
-            yaml.dump(source.helm.values, file)
+        chart_path, helm_cwd = self.__helm_chart_location(source, resolved_repo_path)
 
-        # Create directory for helm output.
-        output_dir = os.path.join(temp_dir, "output")
-        os.mkdir(output_dir)
+        cache_key = None
+        if self.__render_cache is not None:
+            cache_key = self.__helm_render_key(app, source, chart_path, helm_cwd)
+        rendered_files = self.__render_cache.get(cache_key) if cache_key else None
 
-        # Run 'helm template'.
-        helm_args = ["helm", "template", "--dry-run", "--dependency-update"]
+        if rendered_files is not None:
+            log("    Using cached output of helm...", flush=True)
+        else:
+            chart_arg, dependency_update, chart_lock = self.__prepare_helm_chart(
+                source, chart_path, temp_dir
+            )
 
-        if source.chart:
-            helm_args += ["--repo", source.repo_url]
+            # Run 'helm template'.
+            helm_args = ["helm", "template", "--dry-run"]
+
+            if dependency_update:
+                helm_args.append("--dependency-update")
 
-        for value_file in source.helm.value_files:
-            helm_args += ["--values", value_file]
+            if source.chart:
+                helm_args += ["--repo", source.repo_url]
 
-        if app.destination_namespace:
-            helm_args += ["--namespace", app.destination_namespace]
+            for value_file in source.helm.value_files:
+                helm_args += ["--values", value_file]
 
-        helm_args += [
-            "--version",
-            source.target_revision,
-            "--values",
-            values_file,
-            "--output-dir",
-            output_dir,
-        ]
+            if app.destination_namespace:
+                helm_args += ["--namespace", app.destination_namespace]
 
-        helm_args += additional_helm_args or []
+            # Values are given on stdin, the manifests are read from stdout.
+            helm_args += ["--version", source.target_revision, "--values", "-"]
 
-        for name, path in source.helm.file_parameters:
-            helm_args += ["--set-file", f"{name}={path}"]
+            helm_args += self.__config.helm_args
 
-        orig_cwd = os.getcwd()
+            for name, path in source.helm.file_parameters:
+                helm_args += ["--set-file", f"{name}={path}"]
 
-        print("    Running helm...", flush=True)
-        try:
             helm_args.append(source.helm.release_name or app.name)
+            helm_args.append(chart_arg)
 
-            if source.chart:
-                helm_args.append(source.chart)
-            else:
-                chart_path = resolved_repo_path + "/" + source.path
-                helm_args.append(chart_path)
-                os.chdir(chart_path)
+            log("    Running helm...", flush=True)
+            with chart_lock, self.__profile("helm"):
+                output = exec_capture_output(
+                    helm_args, cwd=helm_cwd, input=yaml_dump(source.helm.values)
+                )
 
-            exec_capture_output(helm_args)
-        finally:
-            os.chdir(orig_cwd)
+            # Files are split the same way as if helm wrote them to an output directory,
+            # so the origins and the order of the resources are the same.
+            rendered_files = split_helm_template_output(output)
+            if rendered_files is None:
+                rendered_files = [(None, output)]
+
+            if cache_key:
+                self.__render_cache.put(cache_key, rendered_files)
 
-        self.__queue_all_resource_files_in_dir_rec(
-            base_dir=output_dir,
-            dir_origin=resource_ctx.origin + " / " + app.id,
+        resource_ctxs = self.__make_resource_ctxs_for_rendered_files(
+            rendered_files=rendered_files,
+            origin=resource_ctx.origin.child(app.id),
             target_namespace=app.destination_namespace,
+            app_id=app.id,
+        )
+
+        log("    Done.")
+        log("")
+
+        return resource_ctxs
+
+    # Return the chart argument for helm, whether helm must update dependencies, and a lock to hold while rendering.
+    def __prepare_helm_chart(
+        self, source: ArgocdAppSource, chart_path: Union[str, None], temp_dir: LazyTempDir
+    ) -> Tuple[str, bool, ContextManager]:
+        if source.chart:
+            return source.chart, True, contextlib.nullcontext()
+
+        dependencies = ChartDependencies.get_dependencies(chart_path)
+        if not dependencies:
+            return chart_path, False, contextlib.nullcontext()
+
+        if any(
+            str(dependency.get("repository") or "").startswith("file://")
+            for dependency in dependencies
+        ):
+            # Relative file:// dependencies only work from the original location of the chart,
+            # so dependencies are updated in place, by one render of the chart at a time.
+            return (
+                chart_path,
+                True,
+                self.__chart_dependencies.in_place_lock(chart_path),
+            )
+
+        # The resolved 'charts' directory has everything of the chart's own one, it replaces it.
+        # (Not merged with dirs_exist_ok, which needs python 3.8.)
+        chart_copy = os.path.join(temp_dir.path, "chart")
+        shutil.copytree(
+            chart_path,
+            chart_copy,
+            symlinks=True,
+            ignore=lambda dir, names: ["charts"] if dir == chart_path else [],
+        )
+
+        with self.__profile("helm-dependencies"), self.__chart_dependencies.resolved(
+            chart_path
+        ) as charts_dir:
+            shutil.copytree(charts_dir, os.path.join(chart_copy, "charts"), symlinks=True)
+
+        return chart_copy, False, contextlib.nullcontext()
+
+    # Return the local chart path and the directory to run helm in, both are None for remote charts.
+    @staticmethod
+    def __helm_chart_location(
+        source: ArgocdAppSource, resolved_repo_path: str
+    ) -> Tuple[Union[str, None], Union[str, None]]:
+        if source.chart:
+            return None, None
+
+        # Run helm from the chart directory, so relative value files and file parameters work.
+        chart_path = resolved_repo_path + "/" + source.path
+        return chart_path, chart_path
+
+    def __kustomize_render_key(self, kustomization_path: str) -> str:
+        return self.__render_key(
+            tool="kubectl",
+            version_args=["version", "--client"],
+            source_dir=kustomization_path,
+            params={"args": list(self.__config.kustomize_args)},
+        )
+
+    def __helm_render_key(
+        self,
+        app: ArgocdApp,
+        source: ArgocdAppSource,
+        chart_path: Union[str, None],
+        helm_cwd: Union[str, None],
+    ) -> str:
+        def local_file_digest(path: str) -> Union[str, None]:
+            path = os.path.join(helm_cwd or os.getcwd(), path)
+            return file_digest(path) if os.path.isfile(path) else None
+
+        params = {
+            "values": source.helm.values,
+            "value_files": [
+                [value_file, local_file_digest(value_file)]
+                for value_file in source.helm.value_files
+            ],
+            "file_parameters": [
+                [name, path, local_file_digest(path)]
+                for name, path in source.helm.file_parameters
+            ],
+            "release_name": source.helm.release_name or app.name,
+            "namespace": app.destination_namespace,
+            "args": list(self.__config.helm_args),
+        }
+
+        if source.chart:
+            # Remote charts are identified by the repo, the chart name and the version.
+            params.update(
+                repo_url=source.repo_url,
+                chart=source.chart,
+                version=source.target_revision,
+            )
+
+        return self.__render_key(
+            tool="helm", version_args=["version"], source_dir=chart_path, params=params
+        )
+
+    def __render_key(
+        self,
+        *,
+        tool: str,
+        version_args: List[str],
+        source_dir: Union[str, None],
+        params: dict,
+    ) -> str:
+        components = dict(params)
+        components["tool"] = tool
+        components["tool_version"] = self.__source_digests.tool_version(
+            tool, version_args
         )
+        if source_dir is not None:
+            components["source_tree"] = self.__source_digests.tree_digest(source_dir)
+
+        return make_digest_key(components)
+
+    # Counters of the progress so far, may be called from another thread while rendering.
+    def progress(self) -> Dict[str, Union[int, float]]:
+        elapsed = time.monotonic() - self.__started
+        cache_hits = sum(
+            cache.hits for cache in (self.__render_cache, self.__parse_cache) if cache is not None
+        )
+
+        return {
+            "applications_done": self.__applications_done,
+            "sources_pending": self.__pending_renders,
+            "resources_done": self.__resources_done,
+            "resources_per_second": round(self.__resources_done / elapsed, 1) if elapsed else 0.0,
+            "cache_hits": cache_hits,
+        }
+
+    def report_stats(self) -> None:
+        counts = collections.Counter()
+        for app_graph in self.__app_graphs:
+            counts.update(app_graph.counts)
+        if counts["excluded"] or counts["duplicate"] or counts["cycle"]:
+            log(
+                f"Applications: {counts['render']} rendered, {counts['excluded']} excluded, "
+                + f"{counts['duplicate']} duplicates and {counts['cycle']} cycles skipped."
+            )
+            log("")
+
+        if self.deduplicated_renders:
+            log(
+                f"Identical sources: {self.deduplicated_renders} renders saved."
+            )
+            log("")
+
+        if self.__chart_dependencies.built or self.__chart_dependencies.reused:
+            log(
+                f"Chart dependencies: {self.__chart_dependencies.built} built, "
+                + f"{self.__chart_dependencies.reused} reused."
+            )
+            log("")
+
+        if self.__parse_cache is not None and self.__parse_cache.hits:
+            log(
+                f"Parse cache: {self.__parse_cache.hits} hits, {self.__parse_cache.misses} misses, "
+                + f"{self.__parse_cache.evictions} evictions."
+            )
+            log("")
+
+        if self.__render_cache is not None:
+            log(
+                f"Render cache: {self.__render_cache.hits} hits, {self.__render_cache.misses} misses, "
+                + f"{self.__render_cache.evictions} evictions."
+            )
+            log("")
+
+        if self.__incremental_state is not None:
+            log(
+                f"Incremental: {self.__incremental_state.reused} sources reused, "
+                + f"{self.__incremental_state.rendered} rendered."
+            )
+            log("")
+
+    # Write the result in the given format, see OUTPUT_FORMATS; the output is a directory for 'split'.
+    def write_result(self, output_file: str, *, output_format: str = "yaml") -> None:
+        log(f"Writing result to {repr(output_file)}...")
+
+        try:
+            with open_result_writer(output_file, output_format) as result_writer, self.__profile(
+                "dump"
+            ):
+                for resource_ctx in self.__result_resources:
+                    result_writer.write(resource_ctx.resource, app_id=resource_ctx.app_id)
+        except Exception as e:
+            raise ValueError(f"Failed to write result to {repr(output_file)}") from e
 
-        print("    Done.")
-        print("")
+        log("")
 
-    def write_result(self, output_file: str) -> None:
-        print(f"Writing result to {repr(output_file)}...")
+    # Write the sources recorded in the plan mode and what rendering them would take, as YAML.
+    def write_plan(self, output_file: str) -> None:
+        statuses = collections.Counter(entry["status"] for entry in self.plan)
+        tools = collections.Counter(entry["tool"] for entry in self.plan if entry["tool"])
+
+        log(
+            f"Plan: {len(self.plan)} sources, "
+            + ", ".join(f"{count} {tool} runs" for tool, count in sorted(tools.items()))
+            + (", " if tools else "")
+            + f"{statuses['cached']} cached, {statuses['unchanged']} unchanged, "
+            + f"{statuses['identical']} identical, {statuses['read']} read as is."
+        )
+        log(f"Writing plan to {repr(output_file)}...")
 
         try:
-            with open(output_file, "w") as file:
-                yaml.dump_all(self.__result_resources, file)
+            with open_output(output_file) as file:
+                file.write(
+                    yaml_dump(
+                        {
+                            "sources": self.plan,
+                            "summary": {
+                                "sources": len(self.plan),
+                                "statuses": dict(sorted(statuses.items())),
+                                "tool_runs": dict(sorted(tools.items())),
+                            },
+                        }
+                    )
+                )
         except Exception as e:
+            raise ValueError(f"Failed to write plan to {repr(output_file)}") from e
+
+        log("")
+
+    # Write each resource to the output file as soon as it is processed, instead of keeping it.
+    @contextlib.contextmanager
+    def streaming_result(
+        self, output_file: str, *, output_format: str = "yaml"
+    ) -> Iterator["ArgocdRenderer"]:
+        log(f"Streaming result to {repr(output_file)}...")
+        log("")
+
+        try:
+            with open_result_writer(output_file, output_format) as result_writer:
+                self.__result_writer = result_writer
+                try:
+                    yield self
+                finally:
+                    self.__result_writer = None
+        except OSError as e:
             raise ValueError(f"Failed to write result to {repr(output_file)}") from e
 
-        print("")
+
+# Log a progress line of the renderer every interval seconds until exit, regardless of the log level.
+@contextlib.contextmanager
+def reporting_progress(renderer: ArgocdRenderer, interval: Union[float, None]) -> Iterator[None]:
+    if interval is None:
+        yield
+        return
+
+    stopped = threading.Event()
+
+    def report() -> None:
+        while not stopped.wait(interval):
+            progress = renderer.progress()
+            write_log_records(
+                [
+                    LogRecord(
+                        time=time.time(),
+                        level="info",
+                        msg=f"Progress: {progress['applications_done']} applications done, "
+                        + f"{progress['sources_pending']} sources pending, "
+                        + f"{progress['resources_done']} resources ({progress['resources_per_second']}/s), "
+                        + f"{progress['cache_hits']} cache hits.",
+                        fields={"event": "progress", **progress},
+                    )
+                ],
+                flush=True,
+            )
+
+    thread = threading.Thread(target=report, name="progress", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+# ################################################################################################
+# Batch mode.
+
+
+# Read the list of inputs of the batch mode, with the given defaults for namespace and format.
+def read_batch_file(
+    batch_file: str, *, target_namespace: Union[str, None], output_format: str
+) -> List[BatchEntry]:
+    try:
+        with open(batch_file, "r") as f:
+            items = yaml_load(f)
+    except Exception as e:
+        raise ValueError(f"Failed to read batch file {repr(batch_file)}") from e
+
+    if type(items) is not list:
+        raise ValueError(f"Batch file {repr(batch_file)} must contain a list of inputs")
+
+    entries = []
+    for i, item in enumerate(items):
+        err_path = f"[{i}]"
+        if type(item) is not dict:
+            raise ValueError(f"{err_path} of the batch file must be a dictionary, got {repr(item)}")
+
+        entry = BatchEntry(
+            resources_file=get_str(item, "input", err_path=err_path, req=True),
+            output_file=get_str(item, "output", err_path=err_path, req=True),
+            target_namespace=get_str(item, "namespace", err_path=err_path, req=False)
+            or target_namespace,
+            output_format=get_str(item, "format", err_path=err_path, req=False)
+            or output_format,
+        )
+
+        if entry.output_format not in OUTPUT_FORMATS:
+            raise ValueError(
+                f"{err_path}.format must be one of {', '.join(OUTPUT_FORMATS)}, got {repr(entry.output_format)}"
+            )
+        if entry.output_file == "-":
+            raise ValueError(f"{err_path}.output must be a file, outputs of a batch can't go to stdout")
+        if entry.output_file in (e.output_file for e in entries):
+            raise ValueError(f"{err_path}.output {repr(entry.output_file)} is used by another input")
+
+        entries.append(entry)
+
+    return entries
+
+
+# ################################################################################################
+# Serve mode.
+
+
+# POST /render renders the resources YAML in the request body, the response is the result YAML.
+class RenderRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    server_version = APP_NAME
+
+    def do_GET(self) -> None:
+        path = urllib.parse.urlparse(self.path).path
+        if path == "/health":
+            self.__respond(200, "ok\n")
+        elif path == "/stats":
+            self.__respond(200, json.dumps(self.server.session.stats(), indent=1) + "\n")
+        else:
+            self.__respond(404, "Not found\n")
+
+    def do_POST(self) -> None:
+        url = urllib.parse.urlparse(self.path)
+        if url.path != "/render":
+            self.__respond(404, "Not found\n")
+            return
+
+        query = urllib.parse.parse_qs(url.query)
+        target_namespace = (query.get("namespace") or [None])[0]
+        origin = (query.get("origin") or ["<request>"])[0]
+
+        log_records = []
+        log_buffer.records = log_records
+        try:
+            text = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+            log(f"Rendering {repr(origin)}...")
+            log("")
+            result = self.server.render(text, target_namespace, origin)
+            status = 200
+        except Exception:
+            result = traceback.format_exc()
+            log(result)
+            status = 500
+        finally:
+            log_buffer.records = None
+            write_log_records(log_records)
+
+        self.__respond(status, result)
+
+    def __respond(self, status: int, text: str) -> None:
+        body = text.encode()
+        self.send_response(status)
+        if status != 200:
+            content_type = "text/plain"
+        elif self.command == "POST":
+            content_type = "application/yaml"
+        elif text.startswith("{"):
+            content_type = "application/json"
+        else:
+            content_type = "text/plain"
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: any) -> None:
+        log(f"[{self.log_date_time_string()}] {format % args}", event="request")
+
+
+# The listen backlog of socketserver is 5, so bursts of CI jobs would get their connections refused.
+class RenderHttpServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class RenderUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+# Serve render requests until interrupted.
+def serve(
+    address: str,
+    *,
+    session: RendererSession,
+    target_namespace: Union[str, None],
+    jobs: int,
+    order: str,
+    raw_passthrough: bool,
+    include: Tuple[AppFilter, ...] = (),
+    exclude: Tuple[AppFilter, ...] = (),
+) -> None:
+    default_target_namespace = target_namespace
+
+    def render(text: str, target_namespace: Union[str, None], origin: str) -> str:
+        output = io.StringIO()
+
+        with ArgocdRenderer(
+            session=session,
+            jobs=jobs,
+            order=order,
+            raw_passthrough=raw_passthrough,
+            include=include,
+            exclude=exclude,
+        ) as renderer:
+            result_writer = YamlResultWriter(output)
+            for resource in renderer.render(
+                text,
+                target_namespace=target_namespace or default_target_namespace,
+                origin=origin,
+            ):
+                result_writer.write(resource)
+
+        return output.getvalue()
+
+    if address.startswith("unix:"):
+        socket_path = address[len("unix:") :]
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = RenderUnixServer(socket_path, RenderRequestHandler)
+    else:
+        socket_path = None
+        host, _, port = address.rpartition(":")
+        try:
+            server = RenderHttpServer((host or "127.0.0.1", int(port)), RenderRequestHandler)
+        except ValueError as e:
+            raise ValueError(f"Invalid address to serve on: {repr(address)}") from e
+
+    server.render = render
+    server.session = session
+
+    log(f"Serving render requests on {repr(address)}...", flush=True)
+    log("")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
 
 
 # ################################################################################################
@@ -593,8 +3663,34 @@ if __name__ == "__main__":
         dest="output_file",
         metavar="output_yaml_file",
         type=str,
-        help="output file to save the resources rendered for the found argocd application manifests",
-        required=True,
+        help="output file to save the resources rendered for the found argocd application manifests, '-' for stdout",
+    )
+
+    parser.add_argument(
+        "--batch",
+        dest="batch_file",
+        metavar="batch_file",
+        type=str,
+        help="render many inputs in one run instead of one resources file: a YAML list of "
+        + "{input, output, namespace, format} (namespace and format default to -n and --output-format), "
+        + "repositories, charts and identical sources are shared between the inputs",
+    )
+
+    parser.add_argument(
+        "--output-format",
+        dest="output_format",
+        choices=OUTPUT_FORMATS,
+        default="yaml",
+        help="format of the output: a multi-document YAML file (default), JSON Lines with one resource per line, "
+        + "or 'split' to write a directory with a YAML file per argocd application and an index.json",
+    )
+
+    parser.add_argument(
+        "--stream",
+        dest="stream",
+        action="store_true",
+        help="write each resource to the output as soon as it is processed instead of keeping all of them in memory, "
+        + "needs --order=dfs to use less memory",
     )
 
     parser.add_argument(
@@ -633,49 +3729,485 @@ if __name__ == "__main__":
         help="json/yaml array of strings to pass as additional arguments to kustomize command",
     )
 
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        metavar="jobs",
+        type=int,
+        default=1,
+        help="number of argocd application sources to render concurrently (default: 1)",
+    )
+
+    parser.add_argument(
+        "--max-processes",
+        dest="max_processes",
+        metavar="max_processes",
+        type=int,
+        help="maximum number of helm, kubectl and repo resolver processes running at the same time (default: no limit)",
+    )
+
+    parser.add_argument(
+        "--tool-limit",
+        dest="tool_limits",
+        metavar="tool=n",
+        action="append",
+        default=[],
+        help="maximum number of processes of a tool ('resolver', 'helm' or 'kubectl') running at the same time, "
+        + "can be given for each tool",
+    )
+
+    parser.add_argument(
+        "--command-timeout",
+        dest="command_timeout",
+        metavar="seconds",
+        type=float,
+        help="fail if a helm, kubectl or repo resolver process runs longer than this (default: no timeout)",
+    )
+
+    parser.add_argument(
+        "--order",
+        dest="order",
+        choices=["bfs", "dfs"],
+        default="bfs",
+        help="order of processing the rendered resources: breadth-first or depth-first over the tree of applications "
+        + "(default: bfs)",
+    )
+
+    parser.add_argument(
+        "--include",
+        dest="include",
+        metavar="filter",
+        action="append",
+        default=[],
+        help="render only argocd applications matching one of the filters, with everything under them: "
+        + "id:<pattern>, namespace:<pattern>, label:<key>=<pattern> or label:<key> (patterns are shell-style "
+        + "wildcards), can be given multiple times",
+    )
+
+    parser.add_argument(
+        "--exclude",
+        dest="exclude",
+        metavar="filter",
+        action="append",
+        default=[],
+        help="don't render argocd applications matching one of the filters (see --include) and anything under them, "
+        + "can be given multiple times",
+    )
+
+    parser.add_argument(
+        "--graph-output",
+        dest="graph_output",
+        metavar="graph_file",
+        type=str,
+        help="save the graph of argocd applications (which application rendered which, skipped applications "
+        + "and cycles) as json",
+    )
+
+    parser.add_argument(
+        "--plan",
+        dest="plan",
+        action="store_true",
+        help="don't run helm and kubectl, write which sources would be rendered by which tool and which are "
+        + "cached, unchanged or identical to others to the output (-o) instead of the resources",
+    )
+
+    parser.add_argument(
+        "--raw-passthrough",
+        dest="raw_passthrough",
+        action="store_true",
+        help="copy rendered resources that are not argocd applications to the output as they are, "
+        + "without parsing and dumping them (the output is not normalized then)",
+    )
+
+    parser.add_argument(
+        "--log-level",
+        dest="log_level",
+        choices=LOG_LEVELS,
+        default="info",
+        help="log only messages of this level and above, 'debug' adds the resources found in each file "
+        + "(default: info)",
+    )
+
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        dest="quiet",
+        action="store_true",
+        help="log only warnings and errors, same as --log-level=warning",
+    )
+
+    parser.add_argument(
+        "--log-format",
+        dest="log_format",
+        choices=LOG_FORMATS,
+        default="text",
+        help="format of the log: text lines, or json with one event per line (default: text)",
+    )
+
+    parser.add_argument(
+        "--progress",
+        dest="progress",
+        metavar="seconds",
+        type=float,
+        help="log the progress every given number of seconds: applications done, sources pending, "
+        + "resources per second and cache hits, even with --quiet",
+    )
+
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        action="store_true",
+        help="print wall and CPU time of the rendering stages for each application and source at the end",
+    )
+
+    parser.add_argument(
+        "--profile-top",
+        dest="profile_top",
+        metavar="n",
+        type=int,
+        default=20,
+        help="number of the slowest application sources to print with --profile (default: 20)",
+    )
+
+    parser.add_argument(
+        "--profile-output",
+        dest="profile_output",
+        metavar="profile_file",
+        type=str,
+        help="write the time of the stages by application and source to the given file, implies --profile",
+    )
+
+    parser.add_argument(
+        "--profile-format",
+        dest="profile_format",
+        choices=["json", "chrome"],
+        default="json",
+        help="format of --profile-output: json records with the totals or chrome trace events, "
+        + "where repeated stages of a source are merged into one event (default: json)",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        metavar="cache_dir",
+        type=str,
+        help="directory to keep the outputs of helm and kustomize between runs",
+    )
+
+    parser.add_argument(
+        "--cache-max-size",
+        dest="cache_max_size",
+        metavar="cache_max_size_mb",
+        type=int,
+        default=1024,
+        help="maximum size of the cache in megabytes, least recently used outputs are evicted (default: 1024)",
+    )
+
+    parser.add_argument(
+        "--skip-non-yaml",
+        dest="skip_non_yaml",
+        action="store_true",
+        help="use only .yaml, .yml and .json files of directory sources, as argocd does, other files are not even opened",
+    )
+
+    parser.add_argument(
+        "--parse-workers",
+        dest="parse_workers",
+        metavar="n",
+        type=int,
+        default=0,
+        help="number of processes to parse files of large directory sources in (default: 0, parse in this process)",
+    )
+
+    parser.add_argument(
+        "--parse-cache-size",
+        dest="parse_cache_size",
+        metavar="parse_cache_size_mb",
+        type=int,
+        help="memory for parsed files of directory sources that are used more than once, "
+        + "in megabytes, 0 disables it (default: 0, 128 with --serve)",
+    )
+
+    parser.add_argument(
+        "--incremental",
+        dest="incremental_state_file",
+        metavar="state_file",
+        type=str,
+        help="reuse resources of application sources that haven't changed since the run that wrote "
+        + "the state file, the file is (re)written with the state of this run",
+    )
+
+    parser.add_argument(
+        "--yaml-backend",
+        dest="yaml_backend",
+        choices=["auto", "libyaml", "python"],
+        default="auto",
+        help="YAML implementation to parse with, 'auto' uses libyaml if PyYAML is built with it, "
+        + "the output is always written by the python one (default: auto)",
+    )
+
+    parser.add_argument(
+        "--serve",
+        dest="serve_address",
+        metavar="address",
+        type=str,
+        help="instead of rendering a file, serve render requests over HTTP on 'unix:<socket path>' "
+        + "or '[host:]port' (localhost by default), keeping resolved repositories and chart dependencies",
+    )
+
+    parser.add_argument(
+        "--serve-repo-ttl",
+        dest="serve_repo_ttl",
+        metavar="seconds",
+        type=float,
+        default=300,
+        help="resolve a repository again if it was resolved longer ago than this (default: 300)",
+    )
+
+    parser.add_argument(
+        "--serve-max-repos",
+        dest="serve_max_repos",
+        metavar="n",
+        type=int,
+        default=100,
+        help="number of resolved repositories to keep, least recently used are dropped (default: 100)",
+    )
+
+    parser.add_argument(
+        "--serve-max-charts",
+        dest="serve_max_charts",
+        metavar="n",
+        type=int,
+        default=100,
+        help="number of charts to keep resolved dependencies of, least recently used are dropped (default: 100)",
+    )
+
     parser.add_argument(
         "resources_file",
         metavar="resources_yaml_file",
+        nargs="?",
         type=str,
         help="resources file containing the resources to be used in the argocd application manifest",
     )
 
     args = parser.parse_args()
 
-    global repo_resolver
-    repo_resolver = args.repo_resolver
+    if args.serve_address:
+        if args.output_file or args.resources_file or args.batch_file:
+            parser.error("--serve takes render requests instead of an output and a resources file")
+        if (
+            args.stream
+            or args.incremental_state_file
+            or args.profile
+            or args.profile_output
+            or args.graph_output
+            or args.progress is not None
+        ):
+            parser.error(
+                "--serve can't be used with --stream, --incremental, --profile, --graph-output or --progress"
+            )
+        if args.output_format != "yaml":
+            parser.error("--serve always responds with YAML, --output-format can't be used")
+        if args.plan:
+            parser.error("--serve can't be used with --plan")
+    elif args.batch_file:
+        if args.output_file or args.resources_file:
+            parser.error("--batch takes outputs and resources files from the batch file")
+        if args.stream or args.incremental_state_file or args.graph_output or args.plan:
+            parser.error("--batch can't be used with --stream, --incremental, --graph-output or --plan")
+    elif not args.output_file or not args.resources_file:
+        parser.error("an output file (-o) and a resources file are required")
+    elif args.plan and (args.stream or args.output_format != "yaml"):
+        parser.error("--plan writes the plan as YAML, --stream and --output-format can't be used")
+    elif args.output_format == "split" and args.output_file == "-":
+        parser.error("--output-format=split writes to a directory, the output (-o) can't be '-'")
+
+    if args.output_file == "-":
+        log_stream = sys.stderr
+
+    if args.progress is not None and args.progress <= 0:
+        parser.error("--progress takes a positive number of seconds")
+
+    log_level = LOG_LEVELS.index("warning" if args.quiet else args.log_level)
+    log_format = args.log_format
+
+    log(f"Using {select_yaml_backend(args.yaml_backend)} YAML backend.")
+    log("")
 
-    global additional_helm_args
     if args.helm_args:
         try:
-            additional_helm_args = yaml.full_load(args.helm_args)
+            helm_args = yaml_load(args.helm_args)
         except Exception as e:
             raise ValueError(
                 f"Failed to parse additional helm arguments: {repr(args.helm_args)}"
             ) from e
     else:
-        additional_helm_args = []
+        helm_args = []
 
-    global additional_kustomize_args
     if args.kustomize_args:
         try:
-            additional_kustomize_args = yaml.full_load(args.kustomize_args)
+            kustomize_args = yaml_load(args.kustomize_args)
         except Exception as e:
             raise ValueError(
                 f"Failed to parse additional kustomize arguments: {repr(args.kustomize_args)}"
             ) from e
     else:
-        additional_kustomize_args = []
+        kustomize_args = []
+
+    config = RendererConfig(
+        repo_resolver=args.repo_resolver,
+        helm_args=tuple(helm_args),
+        kustomize_args=tuple(kustomize_args),
+        skip_non_yaml=args.skip_non_yaml,
+    )
+
+    if args.jobs < 1:
+        raise ValueError(f"The number of jobs must be positive, got {args.jobs}")
+
+    if args.parse_workers < 0:
+        raise ValueError(
+            f"The number of parse workers can't be negative, got {args.parse_workers}"
+        )
+
+    if args.max_processes is not None and args.max_processes < 1:
+        raise ValueError(
+            f"The maximum number of processes must be positive, got {args.max_processes}"
+        )
+
+    tool_limits = {}
+    for tool_limit in args.tool_limits:
+        tool, _, limit = tool_limit.partition("=")
+        if tool not in ("resolver", "helm", "kubectl") or not limit.isdigit() or int(limit) < 1:
+            raise ValueError(
+                f"Invalid tool limit {repr(tool_limit)}, expected resolver=n, helm=n or kubectl=n with positive n"
+            )
+        tool_limits[tool] = int(limit)
+
+    include = tuple(AppFilter.parse(app_filter) for app_filter in args.include)
+    exclude = tuple(AppFilter.parse(app_filter) for app_filter in args.exclude)
+
+    command_executor = CommandExecutor(
+        max_processes=args.max_processes,
+        tool_limits=tool_limits,
+        timeout=args.command_timeout,
+    )
+
+    if args.cache_dir:
+        render_cache = RenderCache(
+            cache_dir=args.cache_dir, max_size=args.cache_max_size * 1024 * 1024
+        )
+    else:
+        render_cache = None
+
+    # Files rarely repeat within one run, but they do between the requests of the serve mode.
+    if args.parse_cache_size is None:
+        args.parse_cache_size = 128 if args.serve_address else 0
+
+    if args.parse_cache_size > 0:
+        parse_cache = ParseCache(args.parse_cache_size * 1024 * 1024)
+    else:
+        parse_cache = None
+
+    if args.profile or args.profile_output:
+        profiler = Profiler(timeline=bool(args.profile_output) and args.profile_format == "chrome")
+    else:
+        profiler = None
+
+    if args.incremental_state_file:
+        incremental_state = IncrementalState(args.incremental_state_file)
+    else:
+        incremental_state = None
 
     try:
-        ArgocdRenderer().process_file(
-            resources_file=args.resources_file, target_namespace=args.target_namespace
-        ).write_result(args.output_file)
+        if args.serve_address:
+            # Clean up when stopped by a service manager as well.
+            signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+            with RendererSession(
+                config=config,
+                render_cache=render_cache,
+                parse_cache=parse_cache,
+                repo_ttl=args.serve_repo_ttl,
+                max_repos=args.serve_max_repos,
+                max_charts=args.serve_max_charts,
+                parse_workers=args.parse_workers,
+            ) as session:
+                serve(
+                    args.serve_address,
+                    session=session,
+                    target_namespace=args.target_namespace,
+                    jobs=args.jobs,
+                    order=args.order,
+                    raw_passthrough=args.raw_passthrough,
+                    include=include,
+                    exclude=exclude,
+                )
+            sys.exit(0)
+
+        with ArgocdRenderer(
+            config=config,
+            jobs=args.jobs,
+            parse_workers=args.parse_workers,
+            render_cache=render_cache,
+            parse_cache=parse_cache,
+            order=args.order,
+            raw_passthrough=args.raw_passthrough,
+            profiler=profiler,
+            incremental_state=incremental_state,
+            include=include,
+            exclude=exclude,
+            plan=args.plan,
+        ) as renderer:
+            with reporting_progress(renderer, args.progress):
+                if args.batch_file:
+                    renderer.process_batch(
+                        read_batch_file(
+                            args.batch_file,
+                            target_namespace=args.target_namespace,
+                            output_format=args.output_format,
+                        ),
+                        writers=args.jobs,
+                    )
+                elif args.plan:
+                    renderer.process_file(
+                        resources_file=args.resources_file,
+                        target_namespace=args.target_namespace,
+                    ).write_plan(args.output_file)
+                elif args.stream:
+                    with renderer.streaming_result(
+                        args.output_file, output_format=args.output_format
+                    ):
+                        renderer.process_file(
+                            resources_file=args.resources_file,
+                            target_namespace=args.target_namespace,
+                        )
+                else:
+                    renderer.process_file(
+                        resources_file=args.resources_file,
+                        target_namespace=args.target_namespace,
+                    ).write_result(args.output_file, output_format=args.output_format)
+
+            renderer.report_stats()
+
+            if args.graph_output:
+                renderer.app_graph.write(args.graph_output)
+
+        if incremental_state is not None and not args.plan:
+            incremental_state.save()
+
+        if profiler is not None:
+            profiler.print_report(top=args.profile_top)
+
+            if args.profile_output:
+                profiler.write(args.profile_output, format=args.profile_format)
     except Exception as e:
-        # Flush stdout
-        print("", flush=True)
-        print(
+        log("", level="error")
+        log(
             "--- terminated script because of unexpected error (see also above for a possible reason) ---",
+            level="error",
             flush=True,
         )
         raise e
+    finally:
+        command_executor.close()
@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------------------------
+# https://github.com/kattecon/argocd-renderer
+# Copyright (c) 2024 Evgeny Chukreev (https://github.com/akshaal). All Rights Reserved.
+# SPDX-License-Identifier: MPL-2.0
+#
+# TLDR:
+#   MPL-2.0 requires changes to this file to be publicly available.
+#   Any modifications to this file must keep this entire header intact.
+# ------------------------------------------------------------------------------------------
+
+# Benchmark of argocd-renderer.py on generated application trees.
+#
+# helm and kubectl are replaced by the stubs in the 'stubs' directory, so the numbers are about
+# the renderer itself (plus a configurable latency per helm/kubectl run). Each scenario is run
+# in a separate process, its throughput, peak RSS and time per stage (from --profile-output)
+# are reported. Results can be saved as json and compared with a saved baseline, e.g. to compare
+# two versions of argocd-renderer.py:
+#
+#   ./bench/bench.py --renderer /path/to/old/argocd-renderer.py --json old.json
+#   ./bench/bench.py --baseline old.json
+
+import argparse
+import collections
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Python pre 3.9 doesn't support list[str], but works with List[str].
+from typing import Callable, Dict, List, Union
+
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+STUBS_DIR = os.path.join(BENCH_DIR, "stubs")
+DEFAULT_RENDERER = os.path.join(os.path.dirname(BENCH_DIR), "argocd-renderer.py")
+
+
+# ################################################################################################
+# Generators of the synthetic trees.
+
+
+def write_file(path: str, text: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def config_map(name: str, namespace: str, keys: int = 10) -> str:
+    data = "".join(f"  key-{i}: value-{i}-of-{name}\n" for i in range(keys))
+    return (
+        "apiVersion: v1\n"
+        + "kind: ConfigMap\n"
+        + "metadata:\n"
+        + f"  name: {name}\n"
+        + f"  namespace: {namespace}\n"
+        + "  labels:\n"
+        + "    app.kubernetes.io/part-of: bench\n"
+        + "data:\n"
+        + data
+    )
+
+
+def application(name: str, namespace: str, source: str) -> str:
+    return (
+        "apiVersion: argoproj.io/v1alpha1\n"
+        + "kind: Application\n"
+        + "metadata:\n"
+        + f"  name: {name}\n"
+        + "  namespace: argocd\n"
+        + "spec:\n"
+        + "  project: default\n"
+        + "  destination:\n"
+        + "    server: https://kubernetes.default.svc\n"
+        + f"    namespace: {namespace}\n"
+        + "  source:\n"
+        + "    repoURL: bench://repo\n"
+        + "    targetRevision: HEAD\n"
+        + source
+    )
+
+
+def path_source(path: str) -> str:
+    return f"    path: {path}\n"
+
+
+def helm_source(path: str, release_name: str) -> str:
+    return (
+        f"    path: {path}\n"
+        + "    helm:\n"
+        + f"      releaseName: {release_name}\n"
+        + "      valuesObject:\n"
+        + "        replicas: 2\n"
+    )
+
+
+# Thousands of applications in one directory, each with a small directory source.
+def generate_many_apps(repo_dir: str, scale: float) -> str:
+    apps = max(1, int(2000 * scale))
+    shared_dirs = 50
+
+    for i in range(shared_dirs):
+        write_file(
+            os.path.join(repo_dir, f"many-apps/workloads/{i}/resources.yaml"),
+            "---\n".join(config_map(f"cm-{i}-{j}", f"ns-{i}") for j in range(3)),
+        )
+
+    for i in range(apps):
+        write_file(
+            os.path.join(repo_dir, f"many-apps/apps/app-{i}.yaml"),
+            application(
+                f"app-{i}",
+                f"ns-{i % shared_dirs}",
+                path_source(f"many-apps/workloads/{i % shared_dirs}"),
+            ),
+        )
+
+    return application("many-apps-root", "argocd", path_source("many-apps/apps"))
+
+
+# App of apps nested deeply, each level has some resources and the application of the next level.
+def generate_deep_nesting(repo_dir: str, scale: float) -> str:
+    depth = max(1, int(200 * scale))
+
+    for level in range(depth):
+        docs = [config_map(f"cm-{level}-{j}", f"level-{level}") for j in range(5)]
+        if level + 1 < depth:
+            docs.append(
+                application(
+                    f"level-{level + 1}",
+                    f"level-{level + 1}",
+                    path_source(f"deep-nesting/level-{level + 1}"),
+                )
+            )
+        write_file(
+            os.path.join(repo_dir, f"deep-nesting/level-{level}/resources.yaml"),
+            "---\n".join(docs),
+        )
+
+    return application("level-0", "level-0", path_source("deep-nesting/level-0"))
+
+
+# One directory source with many nested files and documents.
+def generate_large_dirs(repo_dir: str, scale: float) -> str:
+    files = max(1, int(2000 * scale))
+
+    for i in range(files):
+        write_file(
+            os.path.join(repo_dir, f"large-dirs/dir-{i % 20}/sub-{i % 7}/file-{i}.yaml"),
+            "---\n".join(config_map(f"cm-{i}-{j}", "large", keys=20) for j in range(10)),
+        )
+
+    return application("large-dirs", "large", path_source("large-dirs"))
+
+
+# Applications rendering the same helm chart with big output.
+def generate_big_helm(repo_dir: str, scale: float) -> str:
+    apps = max(1, int(50 * scale))
+
+    write_file(
+        os.path.join(repo_dir, "big-helm/chart/Chart.yaml"),
+        "apiVersion: v2\nname: big\nversion: 0.1.0\n",
+    )
+    for i in range(50):
+        write_file(
+            os.path.join(repo_dir, f"big-helm/chart/templates/t-{i}.yaml"),
+            "---\n".join(
+                config_map("{{ .Release.Name }}" + f"-{i}-{j}", "big", keys=20)
+                for j in range(10)
+            ),
+        )
+
+    write_file(
+        os.path.join(repo_dir, "big-helm/apps/apps.yaml"),
+        "---\n".join(
+            application(f"big-{i}", f"big-{i}", helm_source("big-helm/chart", f"big-{i}"))
+            for i in range(apps)
+        ),
+    )
+
+    return application("big-helm-root", "argocd", path_source("big-helm/apps"))
+
+
+# Many applications with kustomize sources.
+def generate_kustomize(repo_dir: str, scale: float) -> str:
+    apps = max(1, int(500 * scale))
+
+    for i in range(apps):
+        base = f"kustomize/k-{i}"
+        for j in range(5):
+            write_file(
+                os.path.join(repo_dir, f"{base}/r-{j}.yaml"),
+                config_map(f"k-{i}-{j}", f"k-{i}"),
+            )
+        write_file(
+            os.path.join(repo_dir, f"{base}/kustomization.yaml"),
+            "resources:\n" + "".join(f"  - r-{j}.yaml\n" for j in range(5)),
+        )
+
+    write_file(
+        os.path.join(repo_dir, "kustomize-apps/apps.yaml"),
+        "---\n".join(
+            application(f"k-{i}", f"k-{i}", path_source(f"kustomize/k-{i}"))
+            for i in range(apps)
+        ),
+    )
+
+    return application("kustomize-root", "argocd", path_source("kustomize-apps"))
+
+
+# Applications with directory sources of very many small resources, mostly about memory per resource.
+def generate_many_resources(repo_dir: str, scale: float) -> str:
+    apps = max(1, int(20 * scale))
+
+    for i in range(apps):
+        for j in range(50):
+            write_file(
+                os.path.join(repo_dir, f"many-resources/app-{i}/dir-{j % 5}/file-{j}.yaml"),
+                "---\n".join(config_map(f"cm-{j}-{k}", f"mr-{i}", keys=1) for k in range(200)),
+            )
+
+    write_file(
+        os.path.join(repo_dir, "many-resources-apps/apps.yaml"),
+        "---\n".join(
+            application(f"mr-{i}", f"mr-{i}", path_source(f"many-resources/app-{i}"))
+            for i in range(apps)
+        ),
+    )
+
+    return application("many-resources-root", "argocd", path_source("many-resources-apps"))
+
+
+SCENARIOS: Dict[str, Callable[[str, float], str]] = collections.OrderedDict(
+    [
+        ("many-apps", generate_many_apps),
+        ("deep-nesting", generate_deep_nesting),
+        ("large-dirs", generate_large_dirs),
+        ("big-helm", generate_big_helm),
+        ("kustomize", generate_kustomize),
+        ("many-resources", generate_many_resources),
+    ]
+)
+
+
+# ################################################################################################
+# Running.
+
+
+def renderer_supports(renderer: str, option: str) -> bool:
+    help_text = subprocess.run(
+        [sys.executable, renderer, "--help"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    ).stdout
+    return option in help_text
+
+
+def count_documents(yaml_file: str) -> int:
+    count = 0
+    with open(yaml_file, "r") as f:
+        for i, line in enumerate(f):
+            if i == 0 or line == "---\n":
+                count += 1
+    return count
+
+
+def run_renderer(
+    *,
+    renderer: str,
+    renderer_args: List[str],
+    work_dir: str,
+    input_file: str,
+    latency: float,
+    profile: bool,
+) -> dict:
+    output_file = os.path.join(work_dir, "output.yaml")
+    profile_file = os.path.join(work_dir, "profile.json")
+    log_file = os.path.join(work_dir, "log.txt")
+
+    cmd = [sys.executable, renderer, "-o", output_file]
+    cmd += ["-r", os.path.join(STUBS_DIR, "repo-resolver.sh")]
+    if profile:
+        cmd += ["--profile-output", profile_file]
+    cmd += renderer_args
+    cmd.append(input_file)
+
+    env = dict(os.environ)
+    env["PATH"] = STUBS_DIR + os.pathsep + env.get("PATH", "")
+    env["BENCH_STUB_LATENCY"] = str(latency)
+    env["BENCH_REPOS_DIR"] = os.path.join(work_dir, "repos")
+
+    with open(log_file, "w") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=env)
+        # wait4 gives resource usage of this run only, RUSAGE_CHILDREN would accumulate over runs.
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+
+    if process.returncode != 0:
+        with open(log_file, "r") as log:
+            tail = "".join(log.readlines()[-20:])
+        raise ValueError(f"Renderer failed with exit code {process.returncode}:\n{tail}")
+
+    stages: Dict[str, float] = collections.defaultdict(float)
+    if profile:
+        with open(profile_file, "r") as f:
+            for record in json.load(f)["records"]:
+                stages[record["stage"]] += record["wall"]
+
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS.
+    peak_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+    return {
+        "resources": count_documents(output_file),
+        "wall": wall,
+        "peak_rss": peak_rss,
+        "stages": dict(stages),
+    }
+
+
+def run_scenario(
+    *,
+    name: str,
+    scale: float,
+    repeat: int,
+    renderer: str,
+    renderer_args: List[str],
+    work_dir: str,
+    latency: float,
+    profile: bool,
+) -> dict:
+    repo_dir = os.path.join(work_dir, "repos", "repo")
+    input_file = os.path.join(work_dir, "input.yaml")
+
+    write_file(input_file, SCENARIOS[name](repo_dir, scale))
+
+    runs = [
+        run_renderer(
+            renderer=renderer,
+            renderer_args=renderer_args,
+            work_dir=work_dir,
+            input_file=input_file,
+            latency=latency,
+            profile=profile,
+        )
+        for _ in range(repeat)
+    ]
+
+    best = min(runs, key=lambda run: run["wall"])
+    return {
+        "resources": best["resources"],
+        "wall": best["wall"],
+        "resources_per_sec": best["resources"] / best["wall"],
+        "peak_rss": max(run["peak_rss"] for run in runs),
+        "stages": best["stages"],
+    }
+
+
+# ################################################################################################
+# Reporting.
+
+
+def change(value: float, baseline: Union[float, None]) -> str:
+    if not baseline:
+        return ""
+    return f" ({(value - baseline) / baseline * 100:+.1f}%)"
+
+
+def print_report(results: Dict[str, dict], baseline: Dict[str, dict]) -> None:
+    for name, result in results.items():
+        base = baseline.get(name) or {}
+
+        print(f"{name}:")
+        print(f"  resources:      {result['resources']}")
+        print(f"  wall:           {result['wall']:.2f}s{change(result['wall'], base.get('wall'))}")
+        print(
+            f"  resources/sec:  {result['resources_per_sec']:.1f}"
+            + change(result["resources_per_sec"], base.get("resources_per_sec"))
+        )
+        print(
+            f"  peak RSS:       {result['peak_rss'] / 1024 / 1024:.1f} MB"
+            + change(result["peak_rss"], base.get("peak_rss"))
+        )
+        print(
+            f"  RSS/resource:   {result['peak_rss'] / result['resources']:.0f} bytes"
+            + change(
+                result["peak_rss"] / result["resources"],
+                base.get("peak_rss") / base["resources"] if base.get("resources") else None,
+            )
+        )
+
+        base_stages = base.get("stages") or {}
+        for stage, wall in sorted(result["stages"].items(), key=lambda x: -x[1]):
+            label = f"stage {stage}:"
+            print(f"  {label:<15} {wall:.2f}s{change(wall, base_stages.get(stage))}")
+
+        print("")
+
+
+# Return the scenarios whose peak RSS grew by more than max_increase percent over the baseline.
+def check_peak_rss(
+    results: Dict[str, dict], baseline: Dict[str, dict], max_increase: float
+) -> List[str]:
+    failed = []
+    for name, result in results.items():
+        base_rss = (baseline.get(name) or {}).get("peak_rss")
+        if base_rss and result["peak_rss"] > base_rss * (1 + max_increase / 100):
+            failed.append(name)
+    return failed
+
+
+# ################################################################################################
+# Main / CLI.
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark argocd-renderer.py on generated application trees."
+    )
+
+    parser.add_argument(
+        "-s",
+        "--scenario",
+        dest="scenarios",
+        action="append",
+        choices=list(SCENARIOS),
+        help="scenario to run, can be given multiple times (default: all)",
+    )
+
+    parser.add_argument(
+        "--scale",
+        dest="scale",
+        type=float,
+        default=1.0,
+        help="size multiplier for the generated trees (default: 1.0)",
+    )
+
+    parser.add_argument(
+        "--repeat",
+        dest="repeat",
+        type=int,
+        default=1,
+        help="number of runs of each scenario, the fastest one is reported (default: 1)",
+    )
+
+    parser.add_argument(
+        "--latency",
+        dest="latency",
+        type=float,
+        default=0.01,
+        help="seconds each helm/kubectl stub invocation sleeps (default: 0.01)",
+    )
+
+    parser.add_argument(
+        "--renderer",
+        dest="renderer",
+        type=str,
+        default=DEFAULT_RENDERER,
+        help="path to the argocd-renderer.py to benchmark (default: the one in this repository)",
+    )
+
+    parser.add_argument(
+        "--renderer-args",
+        dest="renderer_args",
+        type=str,
+        help="json/yaml array of strings to pass as additional arguments to the renderer, e.g. '[\"-j\", \"8\"]'",
+    )
+
+    parser.add_argument(
+        "--compare-args",
+        dest="compare_args",
+        type=str,
+        help="json/yaml array of renderer arguments to run each scenario with again instead of --renderer-args, "
+        + "the results are compared with the runs with --renderer-args, e.g. '[\"--stream\"]'",
+    )
+
+    parser.add_argument(
+        "--json",
+        dest="json_file",
+        type=str,
+        help="write the results to the given json file",
+    )
+
+    parser.add_argument(
+        "--baseline",
+        dest="baseline_file",
+        type=str,
+        help="json file written by an earlier run with --json to compare the results with",
+    )
+
+    parser.add_argument(
+        "--max-rss-increase",
+        dest="max_rss_increase",
+        type=float,
+        help="fail if the peak RSS of a scenario is more than this percent above the baseline",
+    )
+
+    parser.add_argument(
+        "--work-dir",
+        dest="work_dir",
+        type=str,
+        help="directory for the generated trees and outputs, kept after the run (default: a temp dir)",
+    )
+
+    args = parser.parse_args()
+
+    if args.max_rss_increase is not None and not (args.baseline_file or args.compare_args):
+        parser.error("--max-rss-increase requires --baseline or --compare-args")
+    if args.baseline_file and args.compare_args:
+        parser.error("--baseline and --compare-args can't be used together")
+
+    # The renderer needs PyYAML anyway, json arrays are valid yaml.
+    if args.renderer_args or args.compare_args:
+        import yaml
+
+    renderer_args = yaml.safe_load(args.renderer_args) if args.renderer_args else []
+    compare_args = yaml.safe_load(args.compare_args) if args.compare_args else None
+
+    baseline = {}
+    if args.baseline_file:
+        with open(args.baseline_file, "r") as f:
+            baseline = json.load(f)["scenarios"]
+
+    profile = renderer_supports(args.renderer, "--profile-output")
+    if not profile:
+        print("The renderer doesn't support --profile-output, time per stage is not reported.\n")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="argocd-renderer-bench-")
+
+    results = collections.OrderedDict()
+    try:
+        for name in args.scenarios or list(SCENARIOS):
+            scenario_dir = os.path.join(work_dir, name)
+
+            # With --compare-args, the runs with --renderer-args are the baseline.
+            runs = [(renderer_args, results)]
+            if compare_args is not None:
+                runs = [(renderer_args, baseline), (compare_args, results)]
+
+            for run_args, run_results in runs:
+                shutil.rmtree(scenario_dir, ignore_errors=True)
+
+                print(f"Running {name} {json.dumps(run_args)}...", flush=True)
+                run_results[name] = run_scenario(
+                    name=name,
+                    scale=args.scale,
+                    repeat=args.repeat,
+                    renderer=args.renderer,
+                    renderer_args=run_args,
+                    work_dir=scenario_dir,
+                    latency=args.latency,
+                    profile=profile,
+                )
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("")
+    if compare_args is not None:
+        print(f"Changes of {json.dumps(compare_args)} against {json.dumps(renderer_args)}:\n")
+    print_report(results, baseline)
+
+    if args.json_file:
+        with open(args.json_file, "w") as f:
+            json.dump(
+                {
+                    "renderer": os.path.abspath(args.renderer),
+                    "renderer_args": renderer_args if compare_args is None else compare_args,
+                    "scale": args.scale,
+                    "latency": args.latency,
+                    "scenarios": results,
+                },
+                f,
+                indent=1,
+            )
+
+    if args.max_rss_increase is not None:
+        failed = check_peak_rss(results, baseline, args.max_rss_increase)
+        if failed:
+            print(
+                f"Peak RSS is more than {args.max_rss_increase}% above the baseline in: {', '.join(failed)}"
+            )
+            sys.exit(1)
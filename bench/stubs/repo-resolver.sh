@@ -0,0 +1,19 @@
+#!/bin/sh
+
+# Repository resolver used by bench.py: 'bench://<name>' is resolved as '$BENCH_REPOS_DIR/<name>'.
+# The script expects 3 args: the repo URL to resolve, repo revision, and a temp dir.
+
+if [ "$#" -ne 3 ]; then
+    echo "Usage: $0 <repo-url> <revision> <temp-dir>" >&2
+    exit 1
+fi
+
+case "$1" in
+    bench://*)
+        echo "$BENCH_REPOS_DIR/${1#bench://}"
+        ;;
+    *)
+        echo "    ... [repo-resolver.sh] Unknown repo-url: $1" >&2
+        exit 1
+        ;;
+esac
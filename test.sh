@@ -11,13 +11,24 @@ sep() {
     echo ""
 }
 
+# Print the log of the last test and check that it has a line matching the pattern (grep -E).
+check_log() {
+    cat tests/log.tmp.txt
+    if grep -q -E "$1" tests/log.tmp.txt; then
+        echo "Check '$1' in the log passed."
+    else
+        echo "Check '$1' in the log failed."
+        exit 1
+    fi
+}
+
 test() {
     name="$1"
     shift
 
     sep
 
-    ./argocd-renderer.py \
+    ${RENDERER:-./argocd-renderer.py} \
         "$@" \
         -r ./tests/repo-resolver.sh \
         -o tests/$name/result.tmp.yaml \
@@ -44,9 +55,174 @@ test "test-03"
 test "test-04"
 test "test-05" --helm-args="['--set', 'v1=via-arg-arg']"
 test "test-06"
+test "test-07" --order=dfs
+test "test-07" --order=dfs --jobs=4
+test "test-08"
+test "test-08" --jobs=4
+test "test-09"
 
 # ---- Kustomize
 test "test-20"
 
 # ---- As-is
 test "test-40"
+test "test-41" --raw-passthrough
+test "test-42"
+test "test-42" --jobs=4
+test "test-42" --stream --jobs=4
+
+# ---- Application graph
+test "test-43"
+test "test-43" --jobs=4
+test "test-44" --exclude=label:skip=true
+test "test-44" --include=id:argocd/app-a --exclude=label:skip=true --jobs=4
+
+# ---- Plan mode (the plan instead of the resources, same with --jobs)
+test "test-45" --plan
+test "test-45" --plan --jobs=4
+
+# ---- Library API (must produce exactly the same output)
+RENDERER=./tests/library-api.py
+test "test-03"
+test "test-04" --jobs=4
+RENDERER=
+
+# ---- Serve mode (must produce exactly the same output)
+rm -f tests/serve.tmp.sock
+./argocd-renderer.py --serve unix:tests/serve.tmp.sock -r ./tests/repo-resolver.sh --jobs=4 &
+SERVE_PID=$!
+trap 'kill "$SERVE_PID" 2>/dev/null' EXIT
+while [ ! -S tests/serve.tmp.sock ]; do
+    kill -0 "$SERVE_PID" || exit 1
+    sleep 0.1
+done
+RENDERER=./tests/serve-client.sh
+test "test-03"
+test "test-04"
+test "test-20"
+test "test-03"
+RENDERER=
+# A burst of concurrent requests, far more than a listen backlog of 5 would take.
+sep "Serve: 32 concurrent requests"
+CLIENT_PIDS=""
+for i in $(seq 1 32); do
+    ./tests/serve-client.sh -o "tests/test-04/result-$i.tmp.yaml" tests/test-04/input.yaml &
+    CLIENT_PIDS="$CLIENT_PIDS $!"
+done
+for pid in $CLIENT_PIDS; do
+    wait "$pid" || exit 1
+done
+for i in $(seq 1 32); do
+    diff -u tests/test-04/expect.yaml "tests/test-04/result-$i.tmp.yaml" || exit 1
+    rm -f "tests/test-04/result-$i.tmp.yaml"
+done
+echo ""
+echo "Check 'serve concurrent requests' passed."
+kill "$SERVE_PID"
+wait "$SERVE_PID"
+
+# ---- Batch mode (all inputs in one run, must produce exactly the same outputs)
+sep "Batch: tests/batch.yaml"
+./argocd-renderer.py --batch tests/batch.yaml -r ./tests/repo-resolver.sh --jobs=2 || exit "$?"
+for name in test-03 test-04 test-20 test-42; do
+    diff -u tests/$name/expect.yaml tests/$name/result.tmp.yaml || exit 1
+done
+echo ""
+echo "Check 'batch' passed."
+
+# ---- Concurrency (must produce exactly the same output)
+test "test-03" --jobs=4
+test "test-04" --jobs=4
+
+# ---- Process limits (must produce exactly the same output)
+test "test-04" --jobs=4 --tool-limit=helm=1
+test "test-04" --jobs=4 --max-processes=1
+
+# ---- Streaming output (must produce exactly the same output)
+test "test-03" --stream
+test "test-04" --stream --jobs=4
+
+# ---- Output formats (converted back to YAML, must produce exactly the same output)
+RENDERER="./tests/output-format.py jsonl"
+test "test-04"
+# Raw passthrough documents are parsed for JSON, so the output is the same as without it.
+test "test-40" --raw-passthrough
+RENDERER="./tests/output-format.py split"
+test "test-42"
+test "test-42" --stream --jobs=4
+RENDERER=
+
+# ---- Profiling (must produce exactly the same output and a valid profile of the helm renders)
+test "test-04" --profile --profile-output=tests/profile.tmp.json --jobs=4
+python3 -c '
+import json, sys
+records = json.load(open(sys.argv[1]))["records"]
+helm = [r for r in records if r["stage"] == "helm"]
+assert helm and all(r["app"] and r["count"] >= 1 and r["wall"] >= 0 and r["cpu"] >= 0 for r in helm), records
+' tests/profile.tmp.json || exit 1
+echo "Check 'profile json' passed."
+test "test-04" --stream --profile-output=tests/profile.tmp.json --profile-format=chrome
+python3 -c '
+import json, sys
+events = json.load(open(sys.argv[1]))["traceEvents"]
+spans = [e for e in events if e["ph"] == "X"]
+names = {(e["pid"], e["tid"]) for e in events if e["ph"] == "M" and e["name"] == "thread_name"}
+assert any(e["name"] == "helm" for e in spans), events
+assert all(isinstance(e["ts"], int) and e["dur"] >= 0 and (e["pid"], e["tid"]) in names for e in spans), events
+' tests/profile.tmp.json || exit 1
+echo "Check 'profile chrome' passed."
+rm -f tests/profile.tmp.json
+
+# ---- Logging (must produce exactly the same output)
+test "test-04" --quiet --jobs=4
+test "test-43" --log-format=json --log-level=debug --progress=0.01 --jobs=4
+
+# ---- YAML backends (must produce exactly the same output)
+test "test-04" --yaml-backend=python
+test "test-20" --yaml-backend=python
+test "test-09" --yaml-backend=python
+
+# ---- Directory sources
+test "test-40" --skip-non-yaml
+test "test-40" --parse-workers=2
+# Enough files for the parse workers (PARALLEL_PARSE_MIN_FILES).
+test "test-46"
+test "test-46" --parse-workers=2
+test "test-46" --parse-workers=2 --parse-cache-size=16 --jobs=4
+
+# ---- Parse cache (disabled by default)
+test "test-03" --parse-cache-size=16
+test "test-40" --parse-cache-size=16
+test "test-42" --parse-cache-size=16
+
+# ---- Render cache (the first run fills the cache, the second run uses it)
+rm -rf tests/cache.tmp
+test "test-04" --cache-dir=tests/cache.tmp
+test "test-04" --cache-dir=tests/cache.tmp > tests/log.tmp.txt
+check_log "^Render cache: [1-9][0-9]* hits, 0 misses"
+test "test-20" --cache-dir=tests/cache.tmp
+test "test-20" --cache-dir=tests/cache.tmp > tests/log.tmp.txt
+check_log "^Render cache: [1-9][0-9]* hits, 0 misses"
+# Without the cached renders, the chart dependencies come from the cache.
+test "test-08" --cache-dir=tests/cache.tmp
+rm -rf tests/cache.tmp/renders
+test "test-08" --cache-dir=tests/cache.tmp > tests/log.tmp.txt
+check_log "^Chart dependencies: 0 built, [1-9][0-9]* reused"
+rm -rf tests/cache.tmp tests/log.tmp.txt
+
+# ---- Incremental mode (the first run writes the state, the second run reuses it)
+rm -f tests/incremental.tmp
+test "test-04" --incremental=tests/incremental.tmp
+test "test-04" --incremental=tests/incremental.tmp --jobs=4
+rm -f tests/incremental.tmp
+test "test-41" --raw-passthrough --incremental=tests/incremental.tmp
+test "test-41" --raw-passthrough --incremental=tests/incremental.tmp
+rm -f tests/incremental.tmp
+# State written with --raw-passthrough is not reused without it.
+./argocd-renderer.py --raw-passthrough --incremental=tests/incremental.tmp -r ./tests/repo-resolver.sh \
+    -o tests/test-40/result.tmp.yaml tests/test-40/input.yaml > /dev/null || exit "$?"
+test "test-40" --incremental=tests/incremental.tmp
+# A damaged entry of the state is rendered again.
+sed -i 's/^\([ -]*\)origin: /\1damaged_origin: /' tests/incremental.tmp
+test "test-40" --incremental=tests/incremental.tmp
+rm -f tests/incremental.tmp
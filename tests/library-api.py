@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Renders the given resources file through the library API of argocd-renderer.py (ArgocdRenderer.render),
+# used by test.sh to check that it gives the same result as the command line.
+
+import argparse
+import importlib.util
+import os
+import sys
+
+spec = importlib.util.spec_from_file_location(
+    "argocd_renderer",
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "argocd-renderer.py"),
+)
+argocd_renderer = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = argocd_renderer
+spec.loader.exec_module(argocd_renderer)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-r", dest="repo_resolver")
+parser.add_argument("-o", dest="output_file")
+parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1)
+parser.add_argument("resources_file")
+args = parser.parse_args()
+
+argocd_renderer.select_yaml_backend("auto")
+argocd_renderer.log_stream = sys.stderr
+
+with open(args.resources_file, "r") as f:
+    text = f.read()
+
+config = argocd_renderer.RendererConfig(repo_resolver=args.repo_resolver)
+
+# An application with an unsupported field followed by a resource, the render fails on the application.
+failing_text = """
+apiVersion: argoproj.io/v1alpha1
+kind: Application
+metadata:
+  name: failing-app
+  namespace: argocd
+spec:
+  destination:
+    namespace: default
+  source:
+    repoURL: https://example.com
+    targetRevision: HEAD
+    path: a-path
+    directory:
+      recurse: true
+---
+apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: leftover-from-failed-render
+"""
+
+with argocd_renderer.ArgocdRenderer(config=config, jobs=args.jobs) as renderer:
+    # A failed render must not leave anything behind for the next one.
+    try:
+        list(renderer.render(failing_text, origin="<failing>"))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Rendering an application with an unsupported field must fail")
+
+    # Render twice with the same renderer, the second result must be the same as the first one.
+    first_resources = list(renderer.render(text, origin=args.resources_file))
+    resources = list(renderer.render(text, origin=args.resources_file))
+    assert resources == first_resources
+
+with open(args.output_file, "w") as f:
+    writer = argocd_renderer.YamlResultWriter(f)
+    for resource in resources:
+        writer.write(resource)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+# Renders the given resources file by argocd-renderer.py with --output-format=jsonl or split
+# and converts the result back to a multi-document YAML file, used by test.sh to check that
+# the other output formats have the same resources as the YAML output.
+#
+# Usage: output-format.py (jsonl|split) <argocd-renderer.py arguments>
+
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+renderer_path = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "..", "argocd-renderer.py"
+)
+
+spec = importlib.util.spec_from_file_location("argocd_renderer", renderer_path)
+argocd_renderer = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = argocd_renderer
+spec.loader.exec_module(argocd_renderer)
+
+output_format = sys.argv[1]
+args = sys.argv[2:]
+output_file = args[args.index("-o") + 1]
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    output = os.path.join(temp_dir, "output")
+    args[args.index("-o") + 1] = output
+
+    subprocess.run(
+        [renderer_path, f"--output-format={output_format}"] + args, check=True
+    )
+
+    with open(output_file, "w") as f:
+        if output_format == "jsonl":
+            argocd_renderer.select_yaml_backend("auto")
+            writer = argocd_renderer.YamlResultWriter(f)
+            with open(output) as jsonl:
+                for line in jsonl:
+                    writer.write(json.loads(line))
+        else:
+            with open(os.path.join(output, "index.json")) as index:
+                files = json.load(index)["files"]
+
+            # Files are in the order of the result, which is the order of the YAML output
+            # when the resources of every application are output one after another.
+            for i, entry in enumerate(files):
+                if i:
+                    f.write("---\n")
+                with open(os.path.join(output, entry["file"])) as file:
+                    f.write(file.read())
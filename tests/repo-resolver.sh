@@ -30,6 +30,10 @@ if [ "$REPO_URL" = "https://example.com" -a "$REVISION" = "HEAD" ]; then
     RESULT="./tests/simple-repo-01"
 fi
 
+if [ "$REPO_URL" = "https://example.com/cycle" -a "$REVISION" = "HEAD" ]; then
+    RESULT="./tests/cycle-repo-01"
+fi
+
 if [ -n "$RESULT" ]; then
     msg_stderr "Resolved '$REPO_URL' @ '$REVISION' as '$RESULT'."
     echo "$RESULT"
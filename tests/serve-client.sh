@@ -0,0 +1,21 @@
+#!/bin/sh
+
+# Renders a resources file by the server started by test.sh with 'argocd-renderer.py --serve'.
+# Takes the same arguments as test.sh gives to argocd-renderer.py, -r is ignored (the server has it).
+
+SOCKET="tests/serve.tmp.sock"
+
+while [ "$#" -gt 1 ]; do
+    case "$1" in
+        -o) OUTPUT="$2"; shift 2 ;;
+        -r) shift 2 ;;
+        *) echo "Unsupported argument: $1" >&2; exit 1 ;;
+    esac
+done
+
+INPUT="$1"
+
+curl -sS --fail-with-body --unix-socket "$SOCKET" \
+    --data-binary "@$INPUT" \
+    -o "$OUTPUT" \
+    "http://localhost/render?origin=$INPUT"